@@ -5,21 +5,36 @@
 import logging
 import datetime
 import asyncio
-from typing import Dict, Any
+import calendar
+import contextvars
+import itertools
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Set, Tuple
+from urllib.parse import urlparse
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from telegram.error import TelegramError
 from telegram.ext import (
     Application, CommandHandler, ContextTypes,
     CallbackQueryHandler, ConversationHandler,
-    MessageHandler, filters
+    MessageHandler, TypeHandler, Defaults, filters
 )
 
-import aiosqlite
-from database import Database, SESSION_STATUS
+from database import (
+    Database, Session, SESSION_STATUS,
+    CategoryStats, DailyStats, WeeklyStats, MonthlyStats, ReminderCandidate
+)
 from config import (
     TELEGRAM_BOT_TOKEN,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET_TOKEN,
     get_work_categories,
     get_note_categories,
+    get_categories_version,
     reload_categories,
     get_categories_info
 )
@@ -33,6 +48,42 @@ logger = logging.getLogger(__name__)
 # Состояния для ConversationHandler
 (START_WORK, WAITING_NOTE_TEXT, WAITING_NOTE_CATEGORY) = range(3)
 
+# Приветствие для /start, меняется только имя пользователя
+WELCOME_TEMPLATE = (
+    "Привет, {name}! Я бот для отслеживания рабочего времени.\n\n"
+    "Используй следующие команды:\n"
+    "/start_work - Начать рабочий день\n"
+    "/break - Сделать перерыв\n"
+    "/resume - Возобновить работу\n"
+    "/note - Добавить заметку\n"
+    "/my_notes - Просмотр заметок\n"
+    "/end_work - Завершить рабочий день\n"
+    "/stats - Статистика рабочего времени\n"
+    "/export - Экспорт данных в CSV\n"
+    "/reminders - Настройки напоминаний\n"
+    "/calendar - Календарь работы\n"
+    "/categories - Управление категориями"
+)
+
+# Заголовок календаря (/calendar)
+CALENDAR_INTRO = (
+    "📅 <b>Календарь работы</b>\n\n"
+    "Выберите день для просмотра детальной статистики.\n"
+    "Числа показывают время работы в часах или минутах."
+)
+
+# Инструкция по редактированию categories.json
+EDIT_CATEGORIES_HELP = (
+    "✏️ <b>Редактирование категорий</b>\n\n"
+    "Для изменения категорий отредактируйте файл <code>categories.json</code>\n\n"
+    "<b>Структура файла:</b>\n"
+    "<code>{\n"
+    '  "work_categories": ["Разработка", "Совещания", "Документация"],\n'
+    '  "note_categories": ["Общее", "Идея", "Задача"]\n'
+    "}</code>\n\n"
+    "После редактирования используйте команду <code>/categories</code> → <code>Перезагрузить категории</code>"
+)
+
 # Callback данные для кнопок
 CB_START_WORK = "cb_start_work"
 CB_END_WORK = "cb_end_work"
@@ -55,76 +106,397 @@ CB_BREAK_REMINDER_TOGGLE = "break_reminder_toggle"
 CB_LONG_BREAK_REMINDER_TOGGLE = "long_break_reminder_toggle"
 CB_DAILY_GOAL_TOGGLE = "daily_goal_toggle"
 
+# Переключатели напоминаний: callback_data -> колонка настроек
+REMINDER_TOGGLES = {
+    CB_WORK_REMINDER_TOGGLE: "work_reminder_enabled",
+    CB_BREAK_REMINDER_TOGGLE: "break_reminder_enabled",
+    CB_LONG_BREAK_REMINDER_TOGGLE: "long_break_reminder_enabled",
+    CB_DAILY_GOAL_TOGGLE: "daily_goal_enabled",
+}
+
 # Callback данные для календаря
 CB_CALENDAR_DAY = "calendar_day_"
 
+# Скомпилированные шаблоны callback_data для маршрутизации обработчиков
+CATEGORY_RE = re.compile(r"^category_")
+STATS_RE = re.compile(r"^stats_(day|week|month)$")
+NOTE_CATEGORY_RE = re.compile(r"^note_category_")
+REMINDERS_RE = re.compile(r"^(reminders_settings|\w+_toggle|set_\w+|back_to_reminders|\w+_current)$")
+SET_REMINDER_TIME_RE = re.compile(r"^set_\w+$")
+CALENDAR_RE = re.compile(r"^calendar_")
+CATEGORIES_RE = re.compile(r"^(show|reload|edit)_categories$")
+
+# Кнопки и клавиатуры статических меню создаются один раз при импорте
+BTN_START_WORK = InlineKeyboardButton("▶️ Начать работу", callback_data=CB_START_WORK)
+BTN_PAUSE = InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)
+BTN_RESUME = InlineKeyboardButton("▶️ Продолжить", callback_data=CB_RESUME_WORK)
+BTN_NOTE = InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)
+BTN_MORE_NOTE = InlineKeyboardButton("📝 Еще заметка", callback_data=CB_ADD_NOTE)
+BTN_STATS = InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)
+BTN_EXPORT = InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)
+BTN_REMINDERS = InlineKeyboardButton("🔔 Напоминания", callback_data=CB_REMINDERS_SETTINGS)
+BTN_CALENDAR = InlineKeyboardButton("📅 Календарь", callback_data="calendar_show")
+BTN_END = InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)
+BTN_END_DAY = InlineKeyboardButton("⏹️ Завершить день", callback_data=CB_END_WORK)
+BTN_END_WORK = InlineKeyboardButton("⏹️ Завершить работу", callback_data=CB_END_WORK)
+
+# Главное меню (/start)
+KB_MENU_ACTIVE = InlineKeyboardMarkup([
+    [BTN_PAUSE], [BTN_NOTE], [BTN_STATS], [BTN_EXPORT],
+    [BTN_REMINDERS], [BTN_CALENDAR], [BTN_END_WORK]
+])
+KB_MENU_PAUSED = InlineKeyboardMarkup([
+    [BTN_RESUME], [BTN_NOTE], [BTN_STATS], [BTN_EXPORT],
+    [BTN_REMINDERS], [BTN_CALENDAR], [BTN_END_WORK]
+])
+KB_MENU_IDLE = InlineKeyboardMarkup([
+    [BTN_START_WORK], [BTN_STATS], [BTN_EXPORT], [BTN_REMINDERS], [BTN_CALENDAR]
+])
+
+# Действия во время сессии
+KB_SESSION_ACTIVE = InlineKeyboardMarkup([
+    [BTN_PAUSE], [BTN_NOTE], [BTN_STATS], [BTN_EXPORT], [BTN_END]
+])
+KB_SESSION_PAUSED = InlineKeyboardMarkup([
+    [BTN_RESUME], [BTN_NOTE], [BTN_STATS], [BTN_EXPORT], [BTN_END_DAY]
+])
+
+# Действия после сохранения заметки
+KB_NOTE_SAVED_ACTIVE = InlineKeyboardMarkup([[BTN_PAUSE], [BTN_MORE_NOTE], [BTN_END]])
+KB_NOTE_SAVED_PAUSED = InlineKeyboardMarkup([[BTN_RESUME], [BTN_MORE_NOTE], [BTN_END]])
+
+# Выбор периода статистики
+KB_STATS_PERIOD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("📅 День", callback_data=CB_STATS_DAY),
+    InlineKeyboardButton("📆 Неделя", callback_data=CB_STATS_WEEK),
+    InlineKeyboardButton("📊 Месяц", callback_data=CB_STATS_MONTH)
+]])
+
+# Возврат к календарю
+KB_BACK_TO_CALENDAR = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⬅️ К календарю", callback_data="calendar_today")]
+])
+
+# Управление категориями (/categories)
+KB_CATEGORIES_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Показать категории", callback_data="show_categories")],
+    [InlineKeyboardButton("🔄 Перезагрузить категории", callback_data="reload_categories")],
+    [InlineKeyboardButton("✏️ Редактировать категории", callback_data="edit_categories")]
+])
+
+# Кнопки напоминаний
+KB_WORK_REMINDER = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏸️ Сделать перерыв", callback_data=CB_BREAK_WORK)],
+    [BTN_END_WORK]
+])
+KB_BREAK_REMINDER = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏸️ Сделать перерыв", callback_data=CB_BREAK_WORK)]
+])
+KB_LONG_BREAK_REMINDER = InlineKeyboardMarkup([
+    [InlineKeyboardButton("⏸️ Сделать длинный перерыв", callback_data=CB_BREAK_WORK)]
+])
+
+# Переключатели напоминаний (/reminders): все 16 сочетаний включенных флагов
+# в порядке REMINDER_TOGGLES собираются один раз при импорте
+REMINDER_TOGGLE_LABELS = {
+    CB_WORK_REMINDER_TOGGLE: "💼 Работа",
+    CB_BREAK_REMINDER_TOGGLE: "☕ Перерыв",
+    CB_LONG_BREAK_REMINDER_TOGGLE: "⏰ Длинный перерыв",
+    CB_DAILY_GOAL_TOGGLE: "🎯 Ежедневная цель",
+}
+BTN_REMINDER_TIME_SETTINGS = InlineKeyboardButton("⚙️ Настройки времени", callback_data=CB_REMINDERS_SETTINGS)
+KB_REMINDERS = {
+    flags: InlineKeyboardMarkup([
+        *(
+            [InlineKeyboardButton(f"{REMINDER_TOGGLE_LABELS[callback_data]} {'✅' if enabled else '❌'}", callback_data=callback_data)]
+            for callback_data, enabled in zip(REMINDER_TOGGLES, flags)
+        ),
+        [BTN_REMINDER_TIME_SETTINGS]
+    ])
+    for flags in itertools.product((False, True), repeat=len(REMINDER_TOGGLES))
+}
+
+# Неизменяемые элементы календаря: строка дней недели и пустая ячейка
+CALENDAR_WEEKDAY_ROW = [
+    InlineKeyboardButton(day_name, callback_data="calendar_ignore")
+    for day_name in ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+]
+CALENDAR_EMPTY_CELL = InlineKeyboardButton(" ", callback_data="calendar_ignore")
+
 # Категории загружаются динамически из config.py
 # WORK_CATEGORIES и NOTE_CATEGORIES теперь получаются через функции get_work_categories() и get_note_categories()
 
+# Клавиатура категорий работы и обратное соответствие callback_data -> категория.
+# Пересоздаются только при смене версии категорий (после перезагрузки).
+# В callback_data кладется версия и номер категории, а не ее название: Telegram
+# ограничивает callback_data 64 байтами, а кнопки от старой версии не совпадут со словарем
+_work_categories_keyboard: Optional[Tuple[int, InlineKeyboardMarkup, Dict[str, str]]] = None
+
+def _get_work_categories_keyboard() -> Tuple[InlineKeyboardMarkup, Dict[str, str]]:
+    """Получение клавиатуры категорий работы и словаря callback_data -> категория."""
+    global _work_categories_keyboard
+
+    version = get_categories_version()
+    if _work_categories_keyboard is None or _work_categories_keyboard[0] != version:
+        callbacks = {
+            f"category_{version}_{i}": category
+            for i, category in enumerate(get_work_categories())
+        }
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton(category, callback_data=callback_data)]
+            for callback_data, category in callbacks.items()
+        ])
+        _work_categories_keyboard = (version, reply_markup, callbacks)
+
+    return _work_categories_keyboard[1], _work_categories_keyboard[2]
+
+# Клавиатура категорий заметок и соответствие callback_data -> категория,
+# пересоздаются только при смене версии категорий
+_note_categories_keyboard: Optional[Tuple[int, InlineKeyboardMarkup, Dict[str, str]]] = None
+
+def _get_note_categories_keyboard() -> Tuple[InlineKeyboardMarkup, Dict[str, str]]:
+    """Получение клавиатуры категорий заметок и словаря callback_data -> категория."""
+    global _note_categories_keyboard
+
+    version = get_categories_version()
+    if _note_categories_keyboard is None or _note_categories_keyboard[0] != version:
+        callbacks = {
+            f"note_category_{version}_{i}": category
+            for i, category in enumerate(get_note_categories())
+        }
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton(category, callback_data=callback_data)]
+            for callback_data, category in callbacks.items()
+        ])
+        _note_categories_keyboard = (version, reply_markup, callbacks)
+
+    return _note_categories_keyboard[1], _note_categories_keyboard[2]
+
+# Кэши по пользователям хранят записи только для последних USER_CACHE_MAX_USERS
+# пользователей: при переполнении вытесняется тот, к кому дольше всего не обращались
+USER_CACHE_MAX_USERS = 1000
+
+def _lru_store(cache: OrderedDict, key: Any, value: Any, max_size: int = USER_CACHE_MAX_USERS) -> None:
+    """Запись в LRU-кэш с вытеснением самой давней записи при переполнении."""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+
+# Кэш активных сессий {user_id: (сессия, время истечения)}.
+# Сбрасывается при начале, паузе, возобновлении и завершении сессии
+ACTIVE_SESSION_CACHE_TTL = 30  # секунд
+_active_session_cache: OrderedDict[int, Tuple[Optional[Session], float]] = OrderedDict()
+_active_session_locks: OrderedDict[int, asyncio.Lock] = OrderedDict()
+# Поколение данных пользователя: меняется при изменении сессий, перерывов и заметок.
+# По нему проверяются сессия, сохраненная в user_data на время диалога заметки, кэш экспорта и статистики.
+# Значения берутся из общего счетчика и не повторяются: пользователь, вытесненный
+# из словаря, получает _evicted_generation, которое новее всех выданных до вытеснения
+_generation_counter = itertools.count(1)
+_user_data_generation: OrderedDict[int, int] = OrderedDict()
+_evicted_generation = 0
+
+# Кэш CSV экспорта {user_id: (поколение данных, содержимое файла, время истечения)}.
+# Файлы занимают память, поэтому хранятся только для последних EXPORT_CACHE_MAX_USERS пользователей
+EXPORT_CACHE_TTL = 600  # секунд
+EXPORT_CACHE_MAX_USERS = 32
+_export_cache: OrderedDict[int, Tuple[int, bytes, float]] = OrderedDict()
+
+# Кэш статистики {user_id: (поколение данных, {(период, дата): (статистика, время истечения)})}.
+# Записи пользователя отбрасываются целиком при изменении его данных
+STATS_CACHE_TTL = 300  # секунд
+_stats_cache: OrderedDict[int, Tuple[int, Dict[Tuple[str, datetime.date], Tuple[Any, float]]]] = OrderedDict()
+
+# Кэш настроек напоминаний {user_id: (настройки, время истечения)}.
+# Сбрасывается после каждого изменения настроек
+REMINDER_SETTINGS_CACHE_TTL = 30  # секунд
+_reminder_settings_cache: OrderedDict[int, Tuple[Dict[str, Any], float]] = OrderedDict()
+
+# Планировщик напоминаний спит до ближайшего срока напоминания, но не дольше
+# REMINDER_MAX_DELAY. Изменения сессий и настроек будят его раньше
+REMINDER_MAX_DELAY = 300  # секунд
+REMINDER_MIN_DELAY = 5  # секунд
+# Пробуждения от изменений разных пользователей объединяются: после пробуждения
+# следующий проход идет не раньше, чем через столько секунд после предыдущего
+REMINDER_WAKEUP_MIN_GAP = 30  # секунд
+# Не больше стольких одновременных отправок напоминаний (лимиты Telegram)
+REMINDER_SEND_CONCURRENCY = 20
+_reminder_wakeup = asyncio.Event()
+
+# Кэш клавиатур календаря {user_id: {(год, месяц): (клавиатура, время истечения)}}.
+# Сбрасывается при завершении сессии. Прошедшие месяцы меняются редко и живут дольше
+CALENDAR_CACHE_TTL = 60  # секунд
+CALENDAR_PAST_CACHE_TTL = 3600  # секунд
+_calendar_cache: OrderedDict[int, Dict[Tuple[int, int], Tuple[InlineKeyboardMarkup, float]]] = OrderedDict()
+
+# Фоновые задачи бота: напоминания и мониторинг файла категорий
+_background_tasks: Set[asyncio.Task] = set()
+
+# Фоновые подтверждения нажатий кнопок (ссылки нужны, чтобы задачи не собрал GC)
+_answer_tasks: Set[asyncio.Task] = set()
+
+def _on_answer_done(task: asyncio.Task) -> None:
+    """Логирование ошибки фонового подтверждения нажатия."""
+    _answer_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Не удалось подтвердить нажатие кнопки: %s", task.exception())
+
+def answer_in_background(query: CallbackQuery) -> None:
+    """Подтверждение нажатия кнопки без ожидания ответа Telegram."""
+    task = asyncio.create_task(query.answer())
+    _answer_tasks.add(task)
+    task.add_done_callback(_on_answer_done)
+
+# Время текущего обновления. Задается в обработчике группы -1, а неблокирующие
+# обработчики получают копию контекста при создании задачи, поэтому конкурентные
+# обновления одного чата не перезаписывают время друг друга
+_update_now: contextvars.ContextVar[datetime.datetime] = contextvars.ContextVar("_update_now")
+
+async def _inject_now(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Фиксация текущего времени один раз на каждое обновление."""
+    _update_now.set(datetime.datetime.now())
+
+def _get_now() -> datetime.datetime:
+    """Время текущего обновления, зафиксированное в _inject_now."""
+    now = _update_now.get(None)
+    return now if now is not None else datetime.datetime.now()
+
+async def get_active_session_cached(user_id: int) -> Optional[Session]:
+    """Получение активной сессии пользователя с кэшированием."""
+    cached = _active_session_cache.get(user_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    lock = _active_session_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+    _lru_store(_active_session_locks, user_id, lock)
+
+    # Параллельные запросы одного пользователя ждут единственное обращение к базе
+    async with lock:
+        cached = _active_session_cache.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+        # Если сессия изменилась во время запроса, результат мог устареть и не кэшируется
+        generation = get_user_data_generation(user_id)
+        session = await Database.get_active_session(user_id)
+        if get_user_data_generation(user_id) == generation:
+            _lru_store(_active_session_cache, user_id, (session, time.monotonic() + ACTIVE_SESSION_CACHE_TTL))
+        return session
+
+def invalidate_active_session(user_id: int) -> None:
+    """Сброс кэша активной сессии пользователя."""
+    _active_session_cache.pop(user_id, None)
+    bump_user_data_generation(user_id)
+    _reminder_wakeup.set()
+
+def get_user_data_generation(user_id: int) -> int:
+    """Текущее поколение данных пользователя."""
+    return _user_data_generation.get(user_id, _evicted_generation)
+
+def bump_user_data_generation(user_id: int) -> None:
+    """Отметка об изменении данных пользователя."""
+    global _evicted_generation
+    _user_data_generation[user_id] = next(_generation_counter)
+    _user_data_generation.move_to_end(user_id)
+    if len(_user_data_generation) > USER_CACHE_MAX_USERS:
+        _user_data_generation.popitem(last=False)
+        _evicted_generation = next(_generation_counter)
+
+async def get_export_csv_cached(user_id: int) -> Optional[bytes]:
+    """CSV экспорт пользователя с кэшированием до изменения его данных."""
+    generation = get_user_data_generation(user_id)
+    cached = _export_cache.pop(user_id, None)
+    if cached and cached[0] == generation and cached[2] > time.monotonic():
+        # Возвращаем запись в конец очереди вытеснения
+        _export_cache[user_id] = cached
+        return cached[1]
+
+    # Заметки из очереди должны попасть в файл
+    await Database.flush_notes()
+    data = await Database.export_user_data_csv(user_id)
+    if data is not None:
+        _lru_store(
+            _export_cache, user_id,
+            (generation, data, time.monotonic() + EXPORT_CACHE_TTL),
+            EXPORT_CACHE_MAX_USERS
+        )
+    return data
+
+async def get_stats_cached(user_id: int, period: str, date: datetime.date) -> Any:
+    """Статистика за день, неделю или месяц (period), содержащие date, с кэшированием."""
+    # Все дни одной недели или месяца попадают в одну запись кэша
+    if period == "week":
+        date -= datetime.timedelta(days=date.weekday())
+    elif period == "month":
+        date = date.replace(day=1)
+
+    generation = get_user_data_generation(user_id)
+    cached_generation, user_cache = _stats_cache.get(user_id, (None, {}))
+    if cached_generation != generation:
+        user_cache = {}
+    _lru_store(_stats_cache, user_id, (generation, user_cache))
+
+    cached = user_cache.get((period, date))
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    if period == "day":
+        stats = await Database.get_daily_stats(user_id, date)
+    elif period == "week":
+        stats = await Database.get_weekly_stats(user_id, date)
+    else:
+        stats = await Database.get_monthly_stats(user_id, date.year, date.month)
+    user_cache[(period, date)] = (stats, time.monotonic() + STATS_CACHE_TTL)
+    return stats
+
+async def get_reminder_settings_cached(user_id: int) -> Dict[str, Any]:
+    """Получение настроек напоминаний пользователя с кэшированием."""
+    cached = _reminder_settings_cache.get(user_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    settings = await Database.get_reminder_settings(user_id)
+    _lru_store(_reminder_settings_cache, user_id, (settings, time.monotonic() + REMINDER_SETTINGS_CACHE_TTL))
+    return settings
+
+def invalidate_reminder_settings(user_id: int) -> None:
+    """Сброс кэша настроек напоминаний пользователя."""
+    _reminder_settings_cache.pop(user_id, None)
+    _reminder_wakeup.set()
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start."""
     user = update.effective_user
     
-    # Регистрируем пользователя в базе данных
-    await Database.add_user(
-        user.id,
-        user.username,
-        user.first_name,
-        user.last_name
+    # Регистрируем пользователя и проверяем активную сессию параллельно
+    _, active_session = await asyncio.gather(
+        Database.add_user(
+            user.id,
+            user.username,
+            user.first_name,
+            user.last_name
+        ),
+        get_active_session_cached(user.id)
     )
-    
-    # Проверяем, есть ли активная сессия
-    active_session = await Database.get_active_session(user.id)
+    # Имя пользователя попадает в экспорт
+    bump_user_data_generation(user.id)
     
     if active_session:
-        if active_session["status"] == "active":
+        if active_session.status == "active":
             # Если есть активная сессия
-            keyboard = [
-                [InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)],
-                [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-                [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-                [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-                [InlineKeyboardButton("🔔 Напоминания", callback_data=CB_REMINDERS_SETTINGS)],
-                [InlineKeyboardButton("📅 Календарь", callback_data="calendar_show")],
-                [InlineKeyboardButton("⏹️ Завершить работу", callback_data=CB_END_WORK)]
-            ]
+            reply_markup = KB_MENU_ACTIVE
         else:
             # Если есть приостановленная сессия
-            keyboard = [
-                [InlineKeyboardButton("▶️ Продолжить", callback_data=CB_RESUME_WORK)],
-                [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-                [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-                [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-                [InlineKeyboardButton("🔔 Напоминания", callback_data=CB_REMINDERS_SETTINGS)],
-                [InlineKeyboardButton("📅 Календарь", callback_data="calendar_show")],
-                [InlineKeyboardButton("⏹️ Завершить работу", callback_data=CB_END_WORK)]
-            ]
+            reply_markup = KB_MENU_PAUSED
     else:
         # Если нет активных сессий
-        keyboard = [
-            [InlineKeyboardButton("▶️ Начать работу", callback_data=CB_START_WORK)],
-            [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-            [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-            [InlineKeyboardButton("🔔 Напоминания", callback_data=CB_REMINDERS_SETTINGS)],
-            [InlineKeyboardButton("📅 Календарь", callback_data="calendar_show")]
-        ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = KB_MENU_IDLE
     
     # Приветственное сообщение
     await update.message.reply_text(
-        f"Привет, {user.first_name}! Я бот для отслеживания рабочего времени.\n\n"
-        "Используй следующие команды:\n"
-        "/start_work - Начать рабочий день\n"
-        "/break - Сделать перерыв\n"
-        "/resume - Возобновить работу\n"
-        "/note - Добавить заметку\n"
-        "/my_notes - Просмотр заметок\n"
-        "/end_work - Завершить рабочий день\n"
-        "/stats - Статистика рабочего времени\n"
-        "/export - Экспорт данных в CSV\n"
-        "/reminders - Настройки напоминаний\n"
-        "/calendar - Календарь работы\n"
-        "/categories - Управление категориями",
+        WELCOME_TEMPLATE.format(name=user.first_name),
         reply_markup=reply_markup
     )
 
@@ -132,275 +504,273 @@ async def start_work_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Обработчик команды /start_work."""
     user = update.effective_user
     
-    # Определяем, вызов через сообщение или callback
-    is_callback = update.callback_query is not None
+    if update.callback_query:
+        answer_in_background(update.callback_query)
     
     # Проверяем, есть ли активная сессия
-    active_session = await Database.get_active_session(user.id)
+    active_session = await get_active_session_cached(user.id)
     
     if active_session:
         # Если есть активная сессия, сообщаем об этом
-        start_time = datetime.datetime.fromisoformat(active_session["start_time"])
-        duration = datetime.datetime.now() - start_time
-        hours, remainder = divmod(int(duration.total_seconds()), 3600)
-        minutes, seconds = divmod(remainder, 60)
+        start_time = active_session.start_time
+        duration = int((_get_now() - start_time).total_seconds())
         
         status_message = ""
-        keyboard = []
+        reply_markup = None
         
-        if active_session["status"] == "active":
+        if active_session.status == "active":
             status_message = "У вас уже есть активная рабочая сессия!"
-            keyboard = [
-                [InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)],
-                [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-                [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-                [InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)]
-            ]
-        elif active_session["status"] == "paused":
+            reply_markup = KB_SESSION_ACTIVE
+        elif active_session.status == "paused":
             status_message = "У вас есть приостановленная рабочая сессия!"
-            keyboard = [
-                [InlineKeyboardButton("▶️ Продолжить", callback_data=CB_RESUME_WORK)],
-                [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-                [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-                [InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)]
-            ]
+            reply_markup = KB_SESSION_PAUSED
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
         message_text = (
             f"{status_message}\n"
             f"Начата: {start_time.strftime('%H:%M:%S')}\n"
-            f"Продолжительность: {hours}ч {minutes}м {seconds}с"
+            f"Продолжительность: {_fmt_hms(duration)}"
         )
         
-        # Отправляем сообщение в зависимости от типа update
-        if is_callback:
-            await update.callback_query.edit_message_text(text=message_text, reply_markup=reply_markup)
-        else:
-            await update.message.reply_text(text=message_text, reply_markup=reply_markup)
-            
+        await _reply(update, message_text, reply_markup=reply_markup)
         return ConversationHandler.END
     
-    # Создаем клавиатуру с категориями работы
-    work_categories = get_work_categories()
-    keyboard = []
-    for category in work_categories:
-        keyboard.append([InlineKeyboardButton(category, callback_data=f"category_{category}")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    message_text = "Выберите категорию работы:"
+    # Клавиатура с категориями работы
+    reply_markup, _ = _get_work_categories_keyboard()
     
-    # Отправляем сообщение в зависимости от типа update
-    if is_callback:
-        await update.callback_query.edit_message_text(text=message_text, reply_markup=reply_markup)
-    else:
-        await update.message.reply_text(text=message_text, reply_markup=reply_markup)
+    await _reply(update, "Выберите категорию работы:", reply_markup=reply_markup)
     
     return START_WORK
 
 async def category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик выбора категории работы."""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query)
     
     user = query.from_user
-    category = query.data.replace("category_", "")
+    reply_markup, callbacks = _get_work_categories_keyboard()
+    category = callbacks.get(query.data)
+    if category is None:
+        # Кнопка осталась от списка категорий до перезагрузки, предлагаем выбрать заново
+        await query.edit_message_text(
+            "Список категорий изменился. Выберите категорию работы:",
+            reply_markup=reply_markup
+        )
+        return START_WORK
     
-    print(f"DEBUG: Выбрана категория: {category}")
+    logger.debug("Выбрана категория: %s", category)
     
     # Начинаем новую рабочую сессию
     session_id = await Database.start_work_session(user.id, category)
+    invalidate_active_session(user.id)
     
     if session_id == -1:
         await query.edit_message_text("У вас уже есть активная рабочая сессия!")
         return ConversationHandler.END
     
-    current_time = datetime.datetime.now().strftime("%H:%M:%S")
-    
-    # Создаем клавиатуру с доступными действиями
-    keyboard = [
-        [InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)],
-        [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-        [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-        [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-        [InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    current_time = _get_now().strftime("%H:%M:%S")
     
     await query.edit_message_text(
         f"✅ Начата рабочая сессия ({category})\n"
         f"⏱️ Время начала: {current_time}\n\n"
         f"Для завершения используйте /end_work",
-        reply_markup=reply_markup
+        reply_markup=KB_SESSION_ACTIVE
     )
     
     return ConversationHandler.END
 
-async def end_work_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик команды /end_work."""
+async def _reply(update: Update, text: str, **kwargs) -> None:
+    """Ответ пользователю: редактирование сообщения для кнопки или новое сообщение для команды."""
+    if update.callback_query:
+        await update.callback_query.edit_message_text(text, **kwargs)
+    else:
+        await update.effective_message.reply_text(text, **kwargs)
+
+def _render_end_session(session_info: Dict[str, Any]) -> str:
+    """Текст сообщения о завершенной сессии."""
+    start_time = session_info["start_time"].strftime("%H:%M:%S")
+    end_time = session_info["end_time"].strftime("%H:%M:%S")
+
+    return (
+        f"✅ Рабочая сессия завершена\n"
+        f"🏷️ Категория: {session_info['category']}\n"
+        f"⏱️ Начало: {start_time}\n"
+        f"⏱️ Конец: {end_time}\n"
+        f"⌛ Продолжительность: {_fmt_hms(session_info['duration'])}\n\n"
+        f"Хорошей работы! Для начала новой сессии используйте /start_work"
+    )
+
+def _render_pause(session: Dict[str, Any], reason: str, now: datetime.datetime) -> str:
+    """Текст сообщения о паузе."""
+    worked = int((now - session["start_time"]).total_seconds())
+
+    return (
+        f"⏸️ Пауза: \"{reason}\"\n"
+        f"⏱️ Отработано: {worked // 3600}ч {worked % 3600 // 60}мин\n\n"
+        f"Чтобы продолжить, используйте /resume"
+    )
+
+def _render_resume(now: datetime.datetime) -> str:
+    """Текст сообщения о возобновлении работы."""
+    return (
+        f"▶️ Работа возобновлена\n"
+        f"⏱️ Время: {now.strftime('%H:%M:%S')}\n\n"
+        f"Для завершения используйте /end_work"
+    )
+
+async def _handle_end(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Завершение рабочей сессии (команда /end_work и кнопка)."""
+    if update.callback_query:
+        answer_in_background(update.callback_query)
+
     user = update.effective_user
-    
+
     # Завершаем активную сессию
     session_info = await Database.end_work_session(user.id)
-    
+    invalidate_active_session(user.id)
+    invalidate_calendar(user.id)
+
     if not session_info:
-        await update.message.reply_text(
+        await _reply(
+            update,
             "У вас нет активной рабочей сессии.\n"
             "Чтобы начать новую сессию, используйте /start_work"
         )
         return
-    
-    # Вычисляем продолжительность сессии в часах и минутах
-    duration_seconds = session_info["duration"]
-    hours, remainder = divmod(duration_seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    
-    start_time = datetime.datetime.fromisoformat(session_info["start_time"]).strftime("%H:%M:%S")
-    end_time = datetime.datetime.fromisoformat(session_info["end_time"]).strftime("%H:%M:%S")
-    
+
     # Отправляем информацию о завершенной сессии
-    await update.message.reply_text(
-        f"✅ Рабочая сессия завершена\n"
-        f"🏷️ Категория: {session_info['category']}\n"
-        f"⏱️ Начало: {start_time}\n"
-        f"⏱️ Конец: {end_time}\n"
-        f"⌛ Продолжительность: {hours}ч {minutes}м {seconds}с\n\n"
-        f"Хорошей работы! Для начала новой сессии используйте /start_work"
-    )
+    await _reply(update, _render_end_session(session_info))
+
+async def _handle_break(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Перерыв в рабочей сессии (команда /break и кнопка)."""
+    if update.callback_query:
+        answer_in_background(update.callback_query)
 
-async def break_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик команды /break."""
     user = update.effective_user
-    
-    print(f"DEBUG: Вызвана команда break пользователем {user.id}")
-    
-    # Получаем текст причины перерыва
+
+    logger.debug("Вызвана команда break пользователем %s", user.id)
+
+    # Получаем текст причины перерыва (только для команды)
     reason = "Перерыв"
     if context.args:
         reason = " ".join(context.args)
-    
+
     # Проверяем, что у пользователя есть активная сессия
-    active_session = await Database.get_active_session(user.id)
+    active_session = await get_active_session_cached(user.id)
     if not active_session:
-        await update.message.reply_text(
+        await _reply(
+            update,
             "У вас нет активной рабочей сессии.\n"
             "Чтобы начать работу, используйте /start_work"
         )
         return
-    
+
     # Проверяем статус активной сессии
-    if active_session["status"] == SESSION_STATUS["PAUSED"]:
-        await update.message.reply_text(
+    if active_session.status == SESSION_STATUS["PAUSED"]:
+        await _reply(
+            update,
             "Ваша сессия уже на паузе.\n"
             "Чтобы продолжить работу, используйте /resume"
         )
         return
-    
+
     # Приостанавливаем сессию
     session = await Database.pause_work_session(user.id, reason)
-    
+    invalidate_active_session(user.id)
+
     if not session:
-        await update.message.reply_text(
+        await _reply(
+            update,
             "У вас нет активной рабочей сессии.\n"
             "Чтобы начать работу, используйте /start_work"
         )
         return
-    
-    # Формируем клавиатуру
-    keyboard = [
-        [InlineKeyboardButton("▶️ Продолжить", callback_data=CB_RESUME_WORK)],
-        [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-        [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-        [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-        [InlineKeyboardButton("⏹️ Завершить день", callback_data=CB_END_WORK)]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+
     # Отправляем сообщение о паузе
-    start_time = datetime.datetime.fromisoformat(session["start_time"])
-    duration = datetime.datetime.now() - start_time
-    hours, remainder = divmod(int(duration.total_seconds()), 3600)
-    minutes, seconds = divmod(remainder, 60)
-    
-    await update.message.reply_text(
-        f"⏸️ Пауза: \"{reason}\"\n"
-        f"⏱️ Отработано: {hours}ч {minutes}мин\n\n"
-        f"Чтобы продолжить, используйте /resume",
-        reply_markup=reply_markup
+    await _reply(
+        update,
+        _render_pause(session, reason, _get_now()),
+        reply_markup=KB_SESSION_PAUSED
     )
 
-async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик команды /resume."""
+async def _handle_resume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Возобновление работы после перерыва (команда /resume и кнопка)."""
+    if update.callback_query:
+        answer_in_background(update.callback_query)
+
     user = update.effective_user
-    
+
     # Возобновляем сессию
     session = await Database.resume_work_session(user.id)
-    
+    invalidate_active_session(user.id)
+
     if not session:
-        await update.message.reply_text(
+        await _reply(
+            update,
             "У вас нет приостановленных сессий.\n"
             "Чтобы начать работу, используйте /start_work"
         )
         return
-    
-    # Формируем клавиатуру
-    keyboard = [
-        [InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)],
-        [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-        [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-        [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-        [InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
+
     # Отправляем сообщение о возобновлении работы
-    current_time = datetime.datetime.now().strftime("%H:%M:%S")
-    
-    await update.message.reply_text(
-        f"▶️ Работа возобновлена\n"
-        f"⏱️ Время: {current_time}\n\n"
-        f"Для завершения используйте /end_work",
-        reply_markup=reply_markup
+    await _reply(
+        update,
+        _render_resume(_get_now()),
+        reply_markup=KB_SESSION_ACTIVE
     )
 
-async def note_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Обработчик команды /note для добавления заметок."""
+async def _handle_add_note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Начало добавления заметки (команда /note и кнопка)."""
+    if update.callback_query:
+        answer_in_background(update.callback_query)
+
     user = update.effective_user
 
-    print(f"DEBUG: Запрошена команда /note пользователем {user.id}")
+    logger.debug("Запрошена команда /note пользователем %s", user.id)
 
     # Проверяем, есть ли активная сессия
-    active_session = await Database.get_active_session(user.id)
+    active_session = await get_active_session_cached(user.id)
 
     if not active_session:
-        await update.message.reply_text(
+        await _reply(
+            update,
             "У вас нет активной рабочей сессии.\n"
             "Чтобы начать работу, используйте /start_work"
         )
         return ConversationHandler.END
 
-    # Сохраняем ID активной сессии в контексте
-    context.user_data["active_session_id"] = active_session["id"]
-    context.user_data["is_callback"] = False
-
-    # Создаем клавиатуру с категориями заметок
-    note_categories = get_note_categories()
-    keyboard = []
-    for category in note_categories:
-        keyboard.append([InlineKeyboardButton(category, callback_data=f"note_category_{category}")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Сохраняем активную сессию в контексте, чтобы save_note не запрашивал ее повторно
+    context.user_data["active_session"] = (active_session, get_user_data_generation(user.id))
 
-    await update.message.reply_text(
+    await _reply(
+        update,
         "📝 Выберите категорию заметки:",
-        reply_markup=reply_markup
+        reply_markup=_get_note_categories_keyboard()[0]
     )
 
     return WAITING_NOTE_CATEGORY
 
+async def end_work_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /end_work."""
+    await _handle_end(update, context)
+
+async def break_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /break."""
+    await _handle_break(update, context)
+
+async def resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /resume."""
+    await _handle_resume(update, context)
+
+async def note_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Обработчик команды /note для добавления заметок."""
+    return await _handle_add_note(update, context)
+
 async def my_notes_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /my_notes для просмотра последних заметок."""
     user = update.effective_user
     
-    # Получаем последние заметки пользователя (максимум 10)
+    # Получаем последние заметки пользователя (максимум 10), включая еще не записанные
+    await Database.flush_notes()
     notes = await Database.get_user_notes(user.id, limit=10)
     
     if not notes:
@@ -410,120 +780,89 @@ async def my_notes_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return
     
     # Формируем сообщение со списком заметок
-    message_text = "📋 Ваши последние заметки:\n\n"
+    parts = ["📋 Ваши последние заметки:\n\n"]
     
     for i, note in enumerate(notes, 1):
-        timestamp = datetime.datetime.fromisoformat(note["timestamp"]).strftime("%d.%m.%Y %H:%M")
-        message_text += (
+        timestamp = note["timestamp"].strftime("%d.%m.%Y %H:%M")
+        parts.append(
             f"{i}. {timestamp} - [{note['category']}] - {note['session_category']}\n"
-            f"<i>{note['content'][:100]}{'...' if len(note['content']) > 100 else ''}</i>\n\n"
+            f"<i>{note['content']}{'...' if note['content_len'] > 100 else ''}</i>\n\n"
         )
     
     # Отправляем список заметок
     await update.message.reply_text(
-        message_text,
+        "".join(parts),
         parse_mode="HTML"
     )
 
-async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик команды /export для экспорта данных в CSV."""
+async def _handle_export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Экспорт данных пользователя в CSV (команда /export и кнопка)."""
+    if update.callback_query:
+        answer_in_background(update.callback_query)
+
     user = update.effective_user
 
     # Проверяем, есть ли у пользователя данные для экспорта
-    sessions = await Database.get_sessions_by_timeframe(user.id, datetime.datetime.min, datetime.datetime.max)
-
-    if not sessions:
-        await update.message.reply_text(
+    if not await Database.has_any_sessions(user.id):
+        await _reply(
+            update,
             "У вас пока нет данных для экспорта.\n"
             "Начните работать с ботом, чтобы накопить статистику!"
         )
         return
 
     # Отправляем сообщение о начале экспорта
-    await update.message.reply_text(
+    await _reply(
+        update,
         "📊 Готовлю CSV файл с вашими данными...\n"
         "Это может занять несколько секунд."
     )
 
-    # Создаем временный файл для экспорта
-    import tempfile
-    import os
-
-    temp_dir = tempfile.gettempdir()
-    file_path = os.path.join(temp_dir, f'work_tracker_export_{user.id}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
-
     try:
-        # Экспортируем все данные пользователя
-        success = await Database.export_user_data_to_csv(user.id, file_path)
-
-        if success:
-            # Отправляем файл пользователю
-            await update.message.reply_document(
-                document=open(file_path, 'rb'),
-                filename=f'work_tracker_{user.first_name}_{datetime.datetime.now().strftime("%Y%m%d")}.csv',
+        # Экспортируем все данные пользователя в память, без временного файла.
+        # Повторный экспорт без изменений данных отдается из кэша
+        data = await get_export_csv_cached(user.id)
+
+        if data is not None:
+            # Отправляем файл отдельным сообщением
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id,
+                document=data,
+                filename=f'work_tracker_{user.first_name}_{_get_now().strftime("%Y%m%d")}.csv',
                 caption="📊 Ваш полный отчет по работе в формате CSV"
             )
 
-            # Удаляем временный файл
-            os.remove(file_path)
-
         else:
-            await update.message.reply_text(
+            await _reply(
+                update,
                 "❌ Произошла ошибка при создании CSV файла.\n"
                 "Попробуйте позже или обратитесь к администратору."
             )
 
-    except Exception as e:
-        await update.message.reply_text(
+    except TelegramError as e:
+        # Ошибки базы данных обрабатываются в Database, здесь остаются только ошибки отправки
+        await _reply(
+            update,
             f"❌ Ошибка при экспорте: {str(e)}\n"
             "Попробуйте позже."
         )
 
-        # Удаляем файл в случае ошибки
-        try:
-            os.remove(file_path)
-        except:
-            pass
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик команды /export для экспорта данных в CSV."""
+    await _handle_export(update, context)
 
-async def reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def reminders_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, settings: Optional[Dict[str, Any]] = None
+) -> None:
     """Обработчик команды /reminders для управления напоминаниями."""
     user = update.effective_user
 
-    # Получаем настройки напоминаний пользователя
-    settings = await Database.get_reminder_settings(user.id)
+    # Получаем настройки напоминаний пользователя, если они не переданы
+    if settings is None:
+        settings = await get_reminder_settings_cached(user.id)
 
-    # Создаем клавиатуру с настройками напоминаний
-    keyboard = [
-        [
-            InlineKeyboardButton(
-                f"💼 Работа {'✅' if settings['work_reminder_enabled'] else '❌'}",
-                callback_data=CB_WORK_REMINDER_TOGGLE
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                f"☕ Перерыв {'✅' if settings['break_reminder_enabled'] else '❌'}",
-                callback_data=CB_BREAK_REMINDER_TOGGLE
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                f"⏰ Длинный перерыв {'✅' if settings['long_break_reminder_enabled'] else '❌'}",
-                callback_data=CB_LONG_BREAK_REMINDER_TOGGLE
-            )
-        ],
-        [
-            InlineKeyboardButton(
-                f"🎯 Ежедневная цель {'✅' if settings['daily_goal_enabled'] else '❌'}",
-                callback_data=CB_DAILY_GOAL_TOGGLE
-            )
-        ],
-        [
-            InlineKeyboardButton("⚙️ Настройки времени", callback_data=CB_REMINDERS_SETTINGS)
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    # Клавиатура с настройками напоминаний берется из готовой таблицы
+    reply_markup = KB_REMINDERS[tuple(bool(settings[field]) for field in REMINDER_TOGGLES.values())]
 
     # Создаем сообщение с текущими настройками
     message_text = (
@@ -544,54 +883,38 @@ async def reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         '✅' if settings['daily_goal_enabled'] else '❌'
     )
 
-    await update.message.reply_text(
+    # Команда отправляет новое сообщение, переключатели обновляют текущее
+    await _reply(
+        update,
         message_text,
         reply_markup=reply_markup,
         parse_mode="HTML"
     )
 
+def _reminder_minutes_field(name: str) -> str:
+    """Колонка настроек для кнопки времени (work_time -> work_reminder_minutes, daily_goal -> daily_goal_minutes)."""
+    if name.endswith("_time"):
+        return name.removesuffix("_time") + "_reminder_minutes"
+    return name + "_minutes"
+
 async def reminders_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий на кнопки напоминаний."""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query)
 
     user = query.from_user
 
-    # Получаем текущие настройки
-    settings = await Database.get_reminder_settings(user.id)
-
-    if query.data == CB_WORK_REMINDER_TOGGLE:
-        # Переключаем напоминание о работе
-        await Database.update_reminder_settings(
-            user.id,
-            work_reminder_enabled=1 if not settings['work_reminder_enabled'] else 0
-        )
-
-    elif query.data == CB_BREAK_REMINDER_TOGGLE:
-        # Переключаем напоминание о перерыве
-        await Database.update_reminder_settings(
-            user.id,
-            break_reminder_enabled=1 if not settings['break_reminder_enabled'] else 0
-        )
-
-    elif query.data == CB_LONG_BREAK_REMINDER_TOGGLE:
-        # Переключаем напоминание о длинном перерыве
-        await Database.update_reminder_settings(
-            user.id,
-            long_break_reminder_enabled=1 if not settings['long_break_reminder_enabled'] else 0
-        )
-
-    elif query.data == CB_DAILY_GOAL_TOGGLE:
-        # Переключаем ежедневную цель
-        await Database.update_reminder_settings(
-            user.id,
-            daily_goal_enabled=1 if not settings['daily_goal_enabled'] else 0
-        )
+    field = REMINDER_TOGGLES.get(query.data)
+    if field is not None:
+        # Переключаем напоминание одним запросом и показываем обновленные настройки
+        settings = await Database.toggle_reminder_flag(user.id, field)
+        invalidate_reminder_settings(user.id)
+        await reminders_command(update, context, settings)
+        return
 
-    # Показываем обновленные настройки после любого изменения
-    await reminders_command(update, context)
+    if query.data == CB_REMINDERS_SETTINGS:
+        settings = await get_reminder_settings_cached(user.id)
 
-    elif query.data == CB_REMINDERS_SETTINGS:
         # Показываем меню настройки времени
         keyboard = [
             [
@@ -626,14 +949,14 @@ async def reminders_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     elif query.data.startswith("set_"):
         # Обработка кнопок установки времени
-        time_type = query.data.replace("set_", "").replace("_time", "_reminder_minutes")
+        name = query.data.removeprefix("set_")
+        time_type = _reminder_minutes_field(name)
 
         # Сохраняем тип времени в контексте для последующей обработки
         context.user_data["setting_reminder_time"] = time_type
-        context.user_data["is_callback"] = True
 
         await query.edit_message_text(
-            f"⏰ Введите новое значение для {query.data.replace('set_', '').replace('_time', '').replace('_', ' ')} (в минутах):"
+            f"⏰ Введите новое значение для {name.removesuffix('_time').replace('_', ' ')} (в минутах):"
         )
 
     elif query.data == "back_to_reminders":
@@ -642,25 +965,29 @@ async def reminders_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     elif query.data.endswith("_current"):
         # Обработка кнопок текущих значений времени - показываем инструкцию
-        time_type = query.data.replace("_current", "").replace("_time", "_reminder_minutes")
-        time_name = query.data.replace("_time_current", "").replace("_", " ").title()
+        name = query.data.removesuffix("_current")
+        time_type = _reminder_minutes_field(name)
+        time_name = name.removesuffix("_time").replace("_", " ").title()
 
         await query.edit_message_text(
             f"📊 <b>Текущее значение: {time_name}</b>\n\n"
             f"Нажмите на кнопку \"Установить {time_name}\" для изменения значения."
         )
 
-async def handle_reminder_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик ввода нового значения времени напоминаний."""
-    user = update.effective_user
-
+async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Единый обработчик текста вне диалогов: ввод времени напоминаний или быстрая заметка."""
     # Проверяем, что пользователь устанавливает время напоминаний
     if context.user_data.get("setting_reminder_time"):
         # Обрабатываем ввод времени напоминаний
         await _process_reminder_time_input(update, context)
-    else:
-        # Если не в режиме установки времени, передаем обработку заметкам
+    elif "note_category" in context.user_data or "active_session" in context.user_data:
+        # Начатый диалог заметки: текст сохраняется как заметка
         await save_note(update, context)
+    else:
+        # Вне диалогов текст не сохраняется и в базу не обращаемся
+        await update.message.reply_text(
+            "Чтобы добавить заметку, используйте /note"
+        )
 
 async def _process_reminder_time_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Внутренняя функция для обработки ввода времени напоминаний."""
@@ -683,10 +1010,10 @@ async def _process_reminder_time_input(update: Update, context: ContextTypes.DEF
 
         # Обновляем настройки в базе данных
         await Database.update_reminder_settings(user.id, **{time_type: minutes})
+        invalidate_reminder_settings(user.id)
 
         # Очищаем контекст
         context.user_data.pop("setting_reminder_time", None)
-        context.user_data.pop("is_callback", None)
 
         # Показываем обновленные настройки
         await update.message.reply_text(
@@ -708,9 +1035,7 @@ async def calendar_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     user = update.effective_user
 
     # Проверяем, есть ли у пользователя данные для календаря
-    sessions = await Database.get_sessions_by_timeframe(user.id, datetime.datetime.min, datetime.datetime.max)
-
-    if not sessions:
+    if not await Database.has_any_sessions(user.id):
         await update.message.reply_text(
             "У вас пока нет данных для просмотра календаря.\n"
             "Начните работать с ботом, чтобы накопить статистику!"
@@ -727,15 +1052,6 @@ async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Получаем информацию о категориях
     categories_info = get_categories_info()
 
-    # Создаем клавиатуру для управления категориями
-    keyboard = [
-        [InlineKeyboardButton("📋 Показать категории", callback_data="show_categories")],
-        [InlineKeyboardButton("🔄 Перезагрузить категории", callback_data="reload_categories")],
-        [InlineKeyboardButton("✏️ Редактировать категории", callback_data="edit_categories")]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     # Создаем сообщение с информацией о категориях
     message_text = (
         "📂 <b>Управление категориями</b>\n\n"
@@ -747,29 +1063,12 @@ async def categories_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     await update.message.reply_text(
         message_text,
-        reply_markup=reply_markup,
+        reply_markup=KB_CATEGORIES_MENU,
         parse_mode="HTML"
     )
 
-async def show_calendar_month(message, user_id: int, year: int = None, month: int = None) -> None:
-    """Показывает календарь на указанный месяц."""
-    if year is None or month is None:
-        today = datetime.date.today()
-        year, month = today.year, today.month
-
-    # Получаем календарь для месяца
-    import calendar
-    cal = calendar.monthcalendar(year, month)
-
-    # Получаем статистику для каждого дня месяца
-    month_stats = {}
-    for week in cal:
-        for day in week:
-            if day > 0:
-                day_date = datetime.date(year, month, day)
-                stats = await Database.get_daily_stats(user_id, day_date)
-                month_stats[day] = stats
-
+def _build_calendar_markup(year: int, month: int, daily_durations: Dict[int, int]) -> InlineKeyboardMarkup:
+    """Построение клавиатуры календаря на месяц."""
     # Создаем клавиатуру календаря
     keyboard = []
 
@@ -778,30 +1077,22 @@ async def show_calendar_month(message, user_id: int, year: int = None, month: in
     keyboard.append([InlineKeyboardButton(f"📅 {month_name} {year}", callback_data="calendar_ignore")])
 
     # Дни недели
-    days_row = []
-    for day_name in ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']:
-        days_row.append(InlineKeyboardButton(day_name, callback_data="calendar_ignore"))
-    keyboard.append(days_row)
+    keyboard.append(CALENDAR_WEEKDAY_ROW)
 
     # Дни месяца
-    for week in cal:
+    for week in calendar.monthcalendar(year, month):
         week_row = []
         for day in week:
             if day == 0:
                 # Пустая ячейка для дней предыдущего/следующего месяца
-                week_row.append(InlineKeyboardButton(" ", callback_data="calendar_ignore"))
+                week_row.append(CALENDAR_EMPTY_CELL)
             else:
-                stats = month_stats.get(day, {})
-                total_duration = stats.get('total_duration', 0)
+                total_duration = daily_durations.get(day, 0)
 
                 if total_duration > 0:
-                    hours, remainder = divmod(total_duration, 3600)
-                    minutes = remainder // 60
-
-                    if hours > 0:
-                        day_text = f"{day} ({hours}ч)"
-                    else:
-                        day_text = f"{day} ({minutes}м)"
+                    # Показываем только одну единицу: часы или, если их нет, минуты
+                    hours = total_duration // 3600
+                    day_text = f"{day} ({hours}ч)" if hours else f"{day} ({total_duration // 60}м)"
                 else:
                     day_text = str(day)
 
@@ -826,99 +1117,104 @@ async def show_calendar_month(message, user_id: int, year: int = None, month: in
 
     keyboard.append(nav_row)
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
+
+async def get_calendar_markup_cached(user_id: int, year: int, month: int) -> InlineKeyboardMarkup:
+    """Получение клавиатуры календаря на месяц с кэшированием."""
+    user_cache = _calendar_cache.get(user_id, {})
+    _lru_store(_calendar_cache, user_id, user_cache)
+    cached = user_cache.get((year, month))
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+
+    daily_durations = await Database.get_daily_durations(user_id, year, month)
+    reply_markup = _build_calendar_markup(year, month, daily_durations)
+
+    # Прошедшие месяцы меняются только при завершении сессии, поэтому живут дольше текущего
+    today = datetime.date.today()
+    if (year, month) < (today.year, today.month):
+        ttl = CALENDAR_PAST_CACHE_TTL
+    else:
+        ttl = CALENDAR_CACHE_TTL
+    user_cache[(year, month)] = (reply_markup, time.monotonic() + ttl)
+    return reply_markup
+
+def invalidate_calendar(user_id: int) -> None:
+    """Сброс кэша календаря пользователя."""
+    _calendar_cache.pop(user_id, None)
+
+async def show_calendar_month(message, user_id: int, year: int = None, month: int = None) -> None:
+    """Показывает календарь на указанный месяц."""
+    if year is None or month is None:
+        today = datetime.date.today()
+        year, month = today.year, today.month
+
+    reply_markup = await get_calendar_markup_cached(user_id, year, month)
 
     await message.reply_text(
-        "📅 <b>Календарь работы</b>\n\n"
-        "Выберите день для просмотра детальной статистики.\n"
-        "Числа показывают время работы в часах или минутах.",
+        CALENDAR_INTRO,
         reply_markup=reply_markup,
         parse_mode="HTML"
     )
 
-async def calendar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик нажатий на календарь."""
-    query = update.callback_query
-    await query.answer()
+async def _calendar_show(query: CallbackQuery, args: List[str]) -> None:
+    """Календарь на текущий месяц (calendar_today, calendar_show)."""
+    await show_calendar_month(query.message, query.from_user.id)
 
-    data = query.data
+async def _calendar_month(query: CallbackQuery, args: List[str]) -> None:
+    """Переход к другому месяцу (calendar_month_<год>_<месяц>)."""
+    if len(args) < 2:
+        await query.edit_message_text("❌ Ошибка формата месяца календаря")
+        return
 
-    if data == "calendar_today" or data == "calendar_show":
-        # Показываем календарь на текущий месяц
-        await show_calendar_month(query.message, query.from_user.id)
+    await show_calendar_month(query.message, query.from_user.id, int(args[0]), int(args[1]))
 
-    elif data.startswith("calendar_month_"):
-        # Переход к другому месяцу
-        parts = data.split("_")
-        if len(parts) >= 4:
-            year, month = parts[2], parts[3]
-            await show_calendar_month(query.message, query.from_user.id, int(year), int(month))
-        else:
-            await query.edit_message_text("❌ Ошибка формата месяца календаря")
-            return
+async def _calendar_day(query: CallbackQuery, args: List[str]) -> None:
+    """Статистика за выбранный день (calendar_day_<год>_<месяц>_<день>)."""
+    if len(args) < 3:
+        await query.edit_message_text("❌ Ошибка формата даты календаря")
+        return
 
-    elif data.startswith("calendar_day_"):
-        # Показываем статистику за выбранный день
-        parts = data.split("_")
-        if len(parts) >= 4:
-            year, month, day = parts[2], parts[3], parts[4]
-            selected_date = datetime.date(int(year), int(month), int(day))
-        else:
-            await query.edit_message_text("❌ Ошибка формата даты календаря")
-            return
+    selected_date = datetime.date(int(args[0]), int(args[1]), int(args[2]))
+    stats = await get_stats_cached(query.from_user.id, "day", selected_date)
+    await show_day_stats(query, stats)
 
-        stats = await Database.get_daily_stats(query.from_user.id, selected_date)
-        await show_day_stats(query, stats)
+async def _calendar_ignore(query: CallbackQuery, args: List[str]) -> None:
+    """Нажатие на неактивную ячейку календаря игнорируется."""
 
-    elif data == "calendar_ignore":
-        # Игнорируем нажатие
-        pass
+# Действия календаря: calendar_<действие>[_аргументы] -> обработчик
+CALENDAR_ACTIONS = {
+    "today": _calendar_show,
+    "show": _calendar_show,
+    "month": _calendar_month,
+    "day": _calendar_day,
+    "ignore": _calendar_ignore,
+}
 
-async def show_day_stats(query, stats: Dict[str, Any]) -> None:
-    """Показывает статистику за выбранный день."""
-    # Форматируем продолжительность
-    total_hours, remainder = divmod(stats["total_duration"], 3600)
-    total_minutes, total_seconds = divmod(remainder, 60)
+async def calendar_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик нажатий на календарь."""
+    query = update.callback_query
+    answer_in_background(query)
 
-    break_hours, remainder = divmod(stats["break_duration"], 3600)
-    break_minutes, break_seconds = divmod(remainder, 60)
+    _, action, *args = query.data.split("_")
 
-    # Формируем сообщение
-    message_text = (
-        f"📊 <b>Статистика за {stats['date']}</b>\n\n"
-        f"📝 Всего сессий: {stats['total_sessions']}\n"
-        f"✅ Завершено: {stats['completed_sessions']}\n"
-        f"⏱️ Активно: {stats['active_sessions']}\n\n"
-        f"⌛ Общее время работы: {total_hours}ч {total_minutes}м {total_seconds}с\n"
-        f"⏸️ Перерывов: {stats['total_breaks']}\n"
-        f"☕ Время перерывов: {break_hours}ч {break_minutes}м {break_seconds}с\n\n"
-    )
+    handler = CALENDAR_ACTIONS.get(action)
+    if handler is not None:
+        await handler(query, args)
 
-    # Добавляем информацию по категориям
-    if stats["categories"]:
-        message_text += "<b>По категориям:</b>\n"
-        for category, data in stats["categories"].items():
-            cat_hours, remainder = divmod(data["duration"], 3600)
-            cat_minutes, cat_seconds = divmod(remainder, 60)
-            message_text += f"- {category}: {data['count']} сессий, {cat_hours}ч {cat_minutes}м\n"
-    else:
-        message_text += "Нет данных по категориям."
-
-    # Кнопка возврата к календарю
-    keyboard = [[InlineKeyboardButton("⬅️ К календарю", callback_data="calendar_today")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    # Отправляем статистику
+async def show_day_stats(query, stats: DailyStats) -> None:
+    """Показывает статистику за выбранный день."""
+    # Отправляем статистику с кнопкой возврата к календарю
     await query.edit_message_text(
-        text=message_text,
-        reply_markup=reply_markup,
+        text=_render_daily_stats(stats),
+        reply_markup=KB_BACK_TO_CALENDAR,
         parse_mode="HTML"
     )
 
 async def categories_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий на кнопки управления категориями."""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query)
 
     if query.data == "show_categories":
         # Показываем текущие категории
@@ -954,19 +1250,8 @@ async def categories_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     elif query.data == "edit_categories":
         # Показываем инструкцию по редактированию файла
-        message_text = (
-            "✏️ <b>Редактирование категорий</b>\n\n"
-            "Для изменения категорий отредактируйте файл <code>categories.json</code>\n\n"
-            "<b>Структура файла:</b>\n"
-            "<code>{\n"
-            '  "work_categories": ["Разработка", "Совещания", "Документация"],\n'
-            '  "note_categories": ["Общее", "Идея", "Задача"]\n'
-            "}</code>\n\n"
-            "После редактирования используйте команду <code>/categories</code> → <code>Перезагрузить категории</code>"
-        )
-
         await query.edit_message_text(
-            text=message_text,
+            text=EDIT_CATEGORIES_HELP,
             parse_mode="HTML"
         )
 
@@ -975,64 +1260,50 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user = update.effective_user
 
     # Проверяем, есть ли у пользователя данные для статистики
-    sessions = await Database.get_sessions_by_timeframe(user.id, datetime.datetime.min, datetime.datetime.max)
-
-    if not sessions:
+    if not await Database.has_any_sessions(user.id):
         await update.message.reply_text(
             "У вас пока нет данных для просмотра статистики.\n"
             "Начните работать с ботом, чтобы накопить статистику!"
         )
         return
 
-    # Создаем клавиатуру для выбора периода
-    keyboard = [
-        [
-            InlineKeyboardButton("📅 День", callback_data=CB_STATS_DAY),
-            InlineKeyboardButton("📆 Неделя", callback_data=CB_STATS_WEEK),
-            InlineKeyboardButton("📊 Месяц", callback_data=CB_STATS_MONTH)
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     # Отправляем сообщение с выбором периода
     await update.message.reply_text(
         "📊 Выберите период для просмотра статистики:",
-        reply_markup=reply_markup
+        reply_markup=KB_STATS_PERIOD
     )
 
 async def stats_period_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик выбора периода статистики."""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query)
 
     user = query.from_user
-    today = datetime.date.today()
+    today = _get_now().date()
 
     # Определяем тип статистики по callback_data
-    if query.data == CB_STATS_DAY:
-        # Статистика за день
-        stats = await Database.get_daily_stats(user.id, today)
-        await send_daily_stats(query, stats)
-
-    elif query.data == CB_STATS_WEEK:
-        # Статистика за неделю
-        stats = await Database.get_weekly_stats(user.id, today)
-        await send_weekly_stats(query, stats)
-
-    elif query.data == CB_STATS_MONTH:
-        # Статистика за месяц
-        stats = await Database.get_monthly_stats(user.id, today.year, today.month)
-        await send_monthly_stats(query, stats)
+    dispatch = STATS_DISPATCH.get(query.data)
+    if dispatch is None:
+        return
 
-    # Обновляем кнопки статистики в интерфейсе, если пользователь нажал на кнопку статистики
+    period, render = dispatch
+    stats = await get_stats_cached(user.id, period, today)
+    await render(query, stats)
 
 async def note_category_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик выбора категории заметки."""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query)
 
-    user = query.from_user
-    category = query.data.replace("note_category_", "")
+    reply_markup, callbacks = _get_note_categories_keyboard()
+    category = callbacks.get(query.data)
+    if category is None:
+        # Кнопка осталась от списка категорий до перезагрузки, предлагаем выбрать заново
+        await query.edit_message_text(
+            "Список категорий изменился. Выберите категорию заметки:",
+            reply_markup=reply_markup
+        )
+        return WAITING_NOTE_CATEGORY
 
     # Сохраняем выбранную категорию в контексте
     context.user_data["note_category"] = category
@@ -1044,441 +1315,306 @@ async def note_category_callback(update: Update, context: ContextTypes.DEFAULT_T
 
     return WAITING_NOTE_TEXT
 
-    # Обновляем кнопки статистики в интерфейсе, если пользователь нажал на кнопку статистики
-    # (чтобы показать выбранный период)
-    if hasattr(query, 'message') and query.message:
-        # Получаем активную сессию для обновления кнопок
-        active_session = await Database.get_active_session(user.id)
-
-        if active_session:
-            if active_session["status"] == "active":
-                keyboard = [
-                    [InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)],
-                    [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-                    [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-                    [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-                    [InlineKeyboardButton("⏹️ Завершить работу", callback_data=CB_END_WORK)]
-                ]
-            else:
-                keyboard = [
-                    [InlineKeyboardButton("▶️ Продолжить", callback_data=CB_RESUME_WORK)],
-                    [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-                    [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-                    [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)],
-                    [InlineKeyboardButton("⏹️ Завершить работу", callback_data=CB_END_WORK)]
-                ]
-        else:
-            keyboard = [
-                [InlineKeyboardButton("▶️ Начать работу", callback_data=CB_START_WORK)],
-                [InlineKeyboardButton("📊 Статистика", callback_data=CB_STATS_DAY)],
-                [InlineKeyboardButton("📁 Экспорт CSV", callback_data=CB_EXPORT_CSV)]
-            ]
+# Названия дней недели для недельной статистики
+DAYS_OF_WEEK = ("Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье")
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
+def _fmt_hm(total_seconds: int) -> str:
+    """Форматирование продолжительности в виде "Xч Yм"."""
+    hours, remainder = divmod(total_seconds, 3600)
+    return f"{hours}ч {remainder // 60}м"
 
-        # Обновляем сообщение с новыми кнопками
-        try:
-            await query.edit_message_reply_markup(reply_markup=reply_markup)
-        except:
-            pass  # Игнорируем ошибки обновления кнопок
+def _fmt_hms(total_seconds: int) -> str:
+    """Форматирование продолжительности в виде "Xч Yм Zс"."""
+    hours, remainder = divmod(total_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours}ч {minutes}м {seconds}с"
+
+def _format_categories(categories: Dict[str, CategoryStats]) -> List[str]:
+    """Строки статистики по категориям."""
+    return [
+        f"- {category}: {data['count']} сессий, {_fmt_hm(data['duration'])}"
+        for category, data in categories.items()
+    ]
+
+def _render_daily_stats(stats: DailyStats) -> str:
+    """Текст статистики за день."""
+    categories = stats["categories"]
+    parts = [
+        f"📊 <b>Статистика за {stats['date']}</b>",
+        "",
+        f"📝 Всего сессий: {stats['total_sessions']}",
+        f"✅ Завершено: {stats['completed_sessions']}",
+        f"⏱️ Активно: {stats['active_sessions']}",
+        "",
+        f"⌛ Общее время работы: {_fmt_hms(stats['total_duration'])}",
+        f"⏸️ Перерывов: {stats['total_breaks']}",
+        f"☕ Время перерывов: {_fmt_hms(stats['break_duration'])}",
+        ""
+    ]
 
-async def send_daily_stats(query: CallbackQuery, stats: Dict[str, Any]) -> None:
-    """Отправляет статистику за день."""
-    # Форматируем продолжительность
-    total_hours, remainder = divmod(stats["total_duration"], 3600)
-    total_minutes, total_seconds = divmod(remainder, 60)
-    
-    break_hours, remainder = divmod(stats["break_duration"], 3600)
-    break_minutes, break_seconds = divmod(remainder, 60)
-    
-    # Формируем сообщение
-    message_text = (
-        f"📊 <b>Статистика за {stats['date']}</b>\n\n"
-        f"📝 Всего сессий: {stats['total_sessions']}\n"
-        f"✅ Завершено: {stats['completed_sessions']}\n"
-        f"⏱️ Активно: {stats['active_sessions']}\n\n"
-        f"⌛ Общее время работы: {total_hours}ч {total_minutes}м {total_seconds}с\n"
-        f"⏸️ Перерывов: {stats['total_breaks']}\n"
-        f"☕ Время перерывов: {break_hours}ч {break_minutes}м {break_seconds}с\n\n"
-    )
-    
     # Добавляем информацию по категориям
-    if stats["categories"]:
-        message_text += "<b>По категориям:</b>\n"
-        for category, data in stats["categories"].items():
-            cat_hours, remainder = divmod(data["duration"], 3600)
-            cat_minutes, cat_seconds = divmod(remainder, 60)
-            message_text += f"- {category}: {data['count']} сессий, {cat_hours}ч {cat_minutes}м\n"
+    if categories:
+        parts.append("<b>По категориям:</b>")
+        parts.extend(_format_categories(categories))
     else:
-        message_text += "Нет данных по категориям."
-    
-    # Отправляем статистику
+        parts.append("Нет данных по категориям.")
+
+    return "\n".join(parts)
+
+async def send_daily_stats(query: CallbackQuery, stats: DailyStats) -> None:
+    """Отправляет статистику за день."""
     await query.edit_message_text(
-        text=message_text,
+        text=_render_daily_stats(stats),
         parse_mode="HTML"
     )
 
-async def send_weekly_stats(query: CallbackQuery, stats: Dict[str, Any]) -> None:
+async def send_weekly_stats(query: CallbackQuery, stats: WeeklyStats) -> None:
     """Отправляет статистику за неделю."""
-    # Форматируем продолжительность
-    total_hours, remainder = divmod(stats["total_duration"], 3600)
-    total_minutes, total_seconds = divmod(remainder, 60)
-    
-    # Формируем сообщение
-    message_text = (
-        f"📊 <b>Статистика за неделю</b>\n"
-        f"<i>с {stats['start_date']} по {stats['end_date']}</i>\n\n"
-        f"📝 Всего сессий: {stats['total_sessions']}\n"
-        f"⌛ Общее время работы: {total_hours}ч {total_minutes}м\n"
-        f"⏸️ Перерывов: {stats['total_breaks']}\n\n"
-    )
-    
+    categories = stats["categories"]
+    parts = [
+        "📊 <b>Статистика за неделю</b>",
+        f"<i>с {stats['start_date']} по {stats['end_date']}</i>",
+        "",
+        f"📝 Всего сессий: {stats['total_sessions']}",
+        f"⌛ Общее время работы: {_fmt_hm(stats['total_duration'])}",
+        f"⏸️ Перерывов: {stats['total_breaks']}",
+        ""
+    ]
+
     # Добавляем информацию по категориям
-    if stats["categories"]:
-        message_text += "<b>По категориям:</b>\n"
-        for category, data in stats["categories"].items():
-            cat_hours, remainder = divmod(data["duration"], 3600)
-            cat_minutes, cat_seconds = divmod(remainder, 60)
-            message_text += f"- {category}: {data['count']} сессий, {cat_hours}ч {cat_minutes}м\n"
-        
-        message_text += "\n"
-    
+    if categories:
+        parts.append("<b>По категориям:</b>")
+        parts.extend(_format_categories(categories))
+        parts.append("")
+
     # Добавляем информацию по дням недели
-    message_text += "<b>По дням недели:</b>\n"
-    days_of_week = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
-    
-    for i, day_stats in enumerate(stats["daily_stats"]):
-        day_name = days_of_week[i]
-        day_hours, remainder = divmod(day_stats["total_duration"], 3600)
-        day_minutes, day_seconds = divmod(remainder, 60)
-        
-        message_text += f"- {day_name}: {day_stats['completed_sessions']} сессий, {day_hours}ч {day_minutes}м\n"
-    
+    parts.append("<b>По дням недели:</b>")
+    parts.extend(
+        f"- {day_name}: {day_stats['completed_sessions']} сессий, {_fmt_hm(day_stats['total_duration'])}"
+        for day_name, day_stats in zip(DAYS_OF_WEEK, stats["daily_stats"])
+    )
+
     # Отправляем статистику
     await query.edit_message_text(
-        text=message_text,
+        text="\n".join(parts),
         parse_mode="HTML"
     )
 
-async def send_monthly_stats(query: CallbackQuery, stats: Dict[str, Any]) -> None:
+async def send_monthly_stats(query: CallbackQuery, stats: MonthlyStats) -> None:
     """Отправляет статистику за месяц."""
-    # Форматируем продолжительность
-    total_hours, remainder = divmod(stats["total_duration"], 3600)
-    total_minutes, total_seconds = divmod(remainder, 60)
-    
-    # Формируем сообщение
-    message_text = (
-        f"📊 <b>Статистика за {stats['month_name']} {stats['year']}</b>\n\n"
-        f"📝 Всего сессий: {stats['total_sessions']}\n"
-        f"⌛ Общее время работы: {total_hours}ч {total_minutes}м\n"
-        f"⏸️ Перерывов: {stats['total_breaks']}\n\n"
-    )
-    
+    categories = stats["categories"]
+    parts = [
+        f"📊 <b>Статистика за {stats['month_name']} {stats['year']}</b>",
+        "",
+        f"📝 Всего сессий: {stats['total_sessions']}",
+        f"⌛ Общее время работы: {_fmt_hm(stats['total_duration'])}",
+        f"⏸️ Перерывов: {stats['total_breaks']}",
+        ""
+    ]
+
     # Добавляем информацию по категориям
-    if stats["categories"]:
-        message_text += "<b>По категориям:</b>\n"
-        for category, data in stats["categories"].items():
-            cat_hours, remainder = divmod(data["duration"], 3600)
-            cat_minutes, cat_seconds = divmod(remainder, 60)
-            message_text += f"- {category}: {data['count']} сессий, {cat_hours}ч {cat_minutes}м\n"
-        
-        message_text += "\n"
-    
+    if categories:
+        parts.append("<b>По категориям:</b>")
+        parts.extend(_format_categories(categories))
+        parts.append("")
+
     # Добавляем информацию по неделям
-    message_text += "<b>По неделям:</b>\n"
-    for i, week_stats in enumerate(stats["weekly_stats"], 1):
-        week_hours, remainder = divmod(week_stats["total_duration"], 3600)
-        week_minutes, week_seconds = divmod(remainder, 60)
-        
-        message_text += (
-            f"- Неделя {i} ({week_stats['start_date']} - {week_stats['end_date']}): "
-            f"{week_stats['total_sessions']} сессий, {week_hours}ч {week_minutes}м\n"
-        )
-    
+    parts.append("<b>По неделям:</b>")
+    parts.extend(
+        f"- Неделя {i} ({week_stats['start_date']} - {week_stats['end_date']}): "
+        f"{week_stats['total_sessions']} сессий, {_fmt_hm(week_stats['total_duration'])}"
+        for i, week_stats in enumerate(stats["weekly_stats"], 1)
+    )
+
     # Отправляем статистику
     await query.edit_message_text(
-        text=message_text,
+        text="\n".join(parts),
         parse_mode="HTML"
     )
 
-async def save_note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+# Период статистики по callback_data: (период для get_stats_cached, отправка)
+STATS_DISPATCH = {
+    CB_STATS_DAY: ("day", send_daily_stats),
+    CB_STATS_WEEK: ("week", send_weekly_stats),
+    CB_STATS_MONTH: ("month", send_monthly_stats),
+}
+
+async def save_note(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик сохранения текста заметки."""
     user = update.effective_user
     note_text = update.message.text
 
-    # Проверяем, есть ли активная сессия
-    active_session = await Database.get_active_session(user.id)
+    # Берем сессию, сохраненную при начале диалога, если с тех пор она не менялась
+    stashed = context.user_data.pop("active_session", None)
+
+    if stashed is not None and stashed[1] == get_user_data_generation(user.id):
+        active_session = stashed[0]
+    else:
+        active_session = await get_active_session_cached(user.id)
 
     if not active_session:
         await update.message.reply_text(
             "У вас нет активной рабочей сессии.\n"
             "Чтобы начать работу, используйте /start_work"
         )
-        return
+        return ConversationHandler.END
 
-    session_id = active_session["id"]
+    session_id = active_session.id
 
-    # Получаем категорию заметки из контекста
-    note_category = context.user_data.get("note_category", "Общее")
+    # Получаем категорию заметки из контекста и сбрасываем состояние диалога
+    note_category = context.user_data.pop("note_category", "Общее")
 
-    print(f"DEBUG: Сохраняем заметку для сессии {session_id}: {note_text[:20]}... Категория: {note_category}")
+    logger.debug(
+        "Сохраняем заметку для сессии %s: %.20s... Категория: %s",
+        session_id, note_text, note_category
+    )
 
-    # Добавляем заметку в базу данных
-    note_id = await Database.add_note(user.id, note_text, session_id, note_category)
-    
-    # Формируем клавиатуру в зависимости от статуса сессии
-    keyboard = []
+    # Записываем заметку в составе пачки и подтверждаем только после записи
+    try:
+        await Database.add_note_batched(user.id, note_text, session_id, note_category)
+    except Exception:
+        logger.exception("Ошибка при сохранении заметки пользователя %s", user.id)
+        await update.message.reply_text(
+            "❌ Не удалось сохранить заметку. Попробуйте еще раз позже."
+        )
+        return ConversationHandler.END
+    bump_user_data_generation(user.id)
     
-    if active_session["status"] == SESSION_STATUS["ACTIVE"]:
-        keyboard = [
-            [InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)],
-            [InlineKeyboardButton("📝 Еще заметка", callback_data=CB_ADD_NOTE)],
-            [InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)]
-        ]
-    elif active_session["status"] == SESSION_STATUS["PAUSED"]:
-        keyboard = [
-            [InlineKeyboardButton("▶️ Продолжить", callback_data=CB_RESUME_WORK)],
-            [InlineKeyboardButton("📝 Еще заметка", callback_data=CB_ADD_NOTE)],
-            [InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)]
-        ]
+    # Выбираем клавиатуру в зависимости от статуса сессии
+    reply_markup = None
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if active_session.status == SESSION_STATUS["ACTIVE"]:
+        reply_markup = KB_NOTE_SAVED_ACTIVE
+    elif active_session.status == SESSION_STATUS["PAUSED"]:
+        reply_markup = KB_NOTE_SAVED_PAUSED
     
     # Отправляем подтверждение
-    current_time = datetime.datetime.now().strftime("%H:%M:%S")
+    current_time = _get_now().strftime("%H:%M:%S")
     
     await update.message.reply_text(
         f"📝 Заметка сохранена!\n"
         f"🕘 Время: {current_time}\n"
-        f"💼 Активность: {active_session['category']}\n\n"
+        f"💼 Активность: {active_session.category}\n\n"
         f"Вы можете продолжать работу.",
         reply_markup=reply_markup
     )
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Отмена текущего диалога."""
-    await update.message.reply_text("Действие отменено.")
     return ConversationHandler.END
 
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик нажатия на инлайн кнопки."""
-    query = update.callback_query
-    await query.answer()
-    
-    print(f"DEBUG: Нажата кнопка: {query.data}")
-    
-    if query.data == CB_START_WORK:
-        # Вызываем команду начала работы
-        await start_work_command(update, context)
-    
-    elif query.data == CB_END_WORK:
-        user = query.from_user
-        session_info = await Database.end_work_session(user.id)
-        
-        if not session_info:
-            await query.edit_message_text(
-                "У вас нет активной рабочей сессии.\n"
-                "Чтобы начать новую сессию, используйте /start_work"
-            )
-            return
-
-        # Форматирование данных
-        start_time = datetime.datetime.fromisoformat(session_info["start_time"])
-        end_time = datetime.datetime.fromisoformat(session_info["end_time"]) 
-        hours, remainder = divmod(session_info["duration"], 3600)
-        minutes, seconds = divmod(remainder, 60)
-        
-        await query.edit_message_text(
-            f"✅ Рабочая сессия завершена\n"
-            f"🏷️ Категория: {session_info['category']}\n"
-            f"⏱️ Начало: {start_time.strftime('%H:%M:%S')}\n"
-            f"⏱️ Конец: {end_time.strftime('%H:%M:%S')}\n"
-            f"⌛ Продолжительность: {hours}ч {minutes}м {seconds}с\n\n"
-            f"Хорошей работы! Для начала новой сессии используйте /start_work"
-        )
-    
-    elif query.data == CB_BREAK_WORK:
-        user = query.from_user
-        
-        # Приостанавливаем сессию
-        session = await Database.pause_work_session(user.id, "Перерыв")
-        
-        if not session:
-            await query.edit_message_text(
-                "У вас нет активной рабочей сессии.\n"
-                "Чтобы начать работу, используйте /start_work"
-            )
-            return
-        
-        # Формируем клавиатуру
-        keyboard = [
-            [InlineKeyboardButton("▶️ Продолжить", callback_data=CB_RESUME_WORK)],
-            [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-            [InlineKeyboardButton("⏹️ Завершить день", callback_data=CB_END_WORK)]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Отправляем сообщение о паузе
-        start_time = datetime.datetime.fromisoformat(session["start_time"])
-        duration = datetime.datetime.now() - start_time
-        hours, remainder = divmod(int(duration.total_seconds()), 3600)
-        minutes, seconds = divmod(remainder, 60)
-        
-        await query.edit_message_text(
-            f"⏸️ Пауза: \"Перерыв\"\n"
-            f"⏱️ Отработано: {hours}ч {minutes}мин\n\n"
-            f"Чтобы продолжить, используйте /resume",
-            reply_markup=reply_markup
-        )
-    
-    elif query.data == CB_RESUME_WORK:
-        user = query.from_user
-        
-        # Возобновляем сессию
-        session = await Database.resume_work_session(user.id)
-        
-        if not session:
-            await query.edit_message_text(
-                "У вас нет приостановленных сессий.\n"
-                "Чтобы начать работу, используйте /start_work"
-            )
-            return
-        
-        # Формируем клавиатуру
-        keyboard = [
-            [InlineKeyboardButton("⏸️ Пауза", callback_data=CB_BREAK_WORK)],
-            [InlineKeyboardButton("📝 Заметка", callback_data=CB_ADD_NOTE)],
-            [InlineKeyboardButton("⏹️ Завершить", callback_data=CB_END_WORK)]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Отправляем сообщение о возобновлении работы
-        current_time = datetime.datetime.now().strftime("%H:%M:%S")
-        
-        await query.edit_message_text(
-            f"▶️ Работа возобновлена\n"
-            f"⏱️ Время: {current_time}\n\n"
-            f"Для завершения используйте /end_work",
-            reply_markup=reply_markup
-        )
-    
-    elif query.data == CB_ADD_NOTE:
-        user = query.from_user
-
-        # Проверяем, есть ли активная сессия
-        active_session = await Database.get_active_session(user.id)
-
-        if not active_session:
-            await query.edit_message_text(
-                "У вас нет активной рабочей сессии.\n"
-                "Чтобы начать работу, используйте /start_work"
-            )
-            return
-
-        # Сохраняем ID активной сессии в контексте
-        context.user_data["active_session_id"] = active_session["id"]
-        context.user_data["is_callback"] = True
-
-        # Создаем клавиатуру с категориями заметок
-        note_categories = get_note_categories()
-        keyboard = []
-        for category in note_categories:
-            keyboard.append([InlineKeyboardButton(category, callback_data=f"note_category_{category}")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(
-            "📝 Выберите категорию заметки:",
-            reply_markup=reply_markup
-        )
-
-    elif query.data == CB_EXPORT_CSV:
-        user = query.from_user
-
-        # Проверяем, есть ли у пользователя данные для экспорта
-        sessions = await Database.get_sessions_by_timeframe(user.id, datetime.datetime.min, datetime.datetime.max)
-
-        if not sessions:
-            await query.edit_message_text(
-                "У вас пока нет данных для экспорта.\n"
-                "Начните работать с ботом, чтобы накопить статистику!"
-            )
-            return
+def _clear_note_state(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Сброс состояния диалога заметки в user_data."""
+    context.user_data.pop("note_category", None)
+    context.user_data.pop("active_session", None)
 
-        # Отправляем сообщение о начале экспорта
-        await query.edit_message_text(
-            "📊 Готовлю CSV файл с вашими данными...\n"
-            "Это может занять несколько секунд."
-        )
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Отмена текущего диалога."""
+    _clear_note_state(context)
+    await _reply(update, "Действие отменено.")
+    return ConversationHandler.END
 
-        # Создаем временный файл для экспорта
-        import tempfile
-        import os
+async def leave_note_for_reminder_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Выход из диалога заметки при переходе к вводу времени напоминаний."""
+    # Иначе введенное число перехватит диалог и сохранит как заметку
+    _clear_note_state(context)
+    await reminders_callback(update, context)
+    return ConversationHandler.END
 
-        temp_dir = tempfile.gettempdir()
-        file_path = os.path.join(temp_dir, f'work_tracker_export_{user.id}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
+# Обработчики кнопок: callback_data -> обработчик
+BUTTON_HANDLERS = {
+    CB_START_WORK: start_work_command,
+    CB_END_WORK: _handle_end,
+    CB_BREAK_WORK: _handle_break,
+    CB_RESUME_WORK: _handle_resume,
+    CB_EXPORT_CSV: _handle_export,
+}
 
-        try:
-            # Экспортируем все данные пользователя
-            success = await Database.export_user_data_to_csv(user.id, file_path)
-
-            if success:
-                # Отправляем файл пользователю через обычное сообщение (не через edit_message_text)
-                # Сначала восстанавливаем исходное сообщение
-                await query.edit_message_text(
-                    "📊 Файл готов! Отправляю ваш отчет..."
-                )
-
-                # Создаем новое сообщение с файлом
-                await context.bot.send_document(
-                    chat_id=query.message.chat_id,
-                    document=open(file_path, 'rb'),
-                    filename=f'work_tracker_{user.first_name}_{datetime.datetime.now().strftime("%Y%m%d")}.csv',
-                    caption="📊 Ваш полный отчет по работе в формате CSV"
-                )
-
-                # Удаляем временный файл
-                os.remove(file_path)
+async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Резервный обработчик нажатия на инлайн кнопки."""
+    query = update.callback_query
 
-            else:
-                await query.edit_message_text(
-                    "❌ Произошла ошибка при создании CSV файла.\n"
-                    "Попробуйте позже или обратитесь к администратору."
-                )
+    logger.debug("Нажата кнопка: %s", query.data)
 
-        except Exception as e:
-            await query.edit_message_text(
-                f"❌ Ошибка при экспорте: {str(e)}\n"
-                "Попробуйте позже."
-            )
+    handler = BUTTON_HANDLERS.get(query.data)
+    if handler is None:
+        # Для кнопки нет обработчика, просто подтверждаем нажатие
+        answer_in_background(query)
+        return
 
-            # Удаляем файл в случае ошибки
-            try:
-                os.remove(file_path)
-            except:
-                pass
+    await handler(update, context)
 
 async def init() -> None:
     """Инициализация базы данных."""
     await Database.init_db()
+    # Соединение открыто в отдельном цикле событий, бот откроет свое
+    await Database.close()
+
+async def post_init(application: Application) -> None:
+    """Запуск фоновых задач в цикле событий бота (run_polling блокирует до остановки)."""
+    _background_tasks.add(asyncio.create_task(reminder_scheduler(application.bot)))
+    _background_tasks.add(asyncio.create_task(categories_monitor()))
+
+async def post_stop(application: Application) -> None:
+    """Остановка фоновых задач до закрытия базы данных."""
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+
+async def shutdown(application: Application) -> None:
+    """Завершение работы: дописываем заметки, оставшиеся в очереди, и закрываем базу."""
+    await Database.stop_note_writer()
+    await Database.close()
 
 def main() -> None:
     """Основная функция запуска бота."""
     # Инициализируем базу данных
-    import asyncio
     asyncio.run(init())
     
-    # Создаем и настраиваем бота с увеличенным таймаутом для соединения
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).connect_timeout(30.0).build()
+    # Создаем и настраиваем бота с увеличенным таймаутом для соединения.
+    # block=False: обработчики выполняются как независимые задачи и не ждут друг друга.
+    # JobQueue не используется, поэтому отключаем его
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .connect_timeout(30.0)
+        .job_queue(None)
+        .defaults(Defaults(block=False))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(shutdown)
+        .build()
+    )
     
     # Добавляем обработчик ошибок
     application.add_error_handler(error_handler)
+
+    # Фиксируем время обновления до запуска остальных обработчиков (блокирующе)
+    application.add_handler(TypeHandler(Update, _inject_now, block=True), group=-1)
     
+    # Диалог добавления заметки: состояние хранит ConversationHandler
+    application.add_handler(ConversationHandler(
+        entry_points=[
+            CommandHandler("note", note_command),
+            CallbackQueryHandler(_handle_add_note, pattern=re.compile(f"^{re.escape(CB_ADD_NOTE)}$")),
+            CallbackQueryHandler(note_category_callback, pattern=NOTE_CATEGORY_RE),
+        ],
+        states={
+            WAITING_NOTE_CATEGORY: [CallbackQueryHandler(note_category_callback, pattern=NOTE_CATEGORY_RE)],
+            WAITING_NOTE_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_note)],
+        },
+        # conversation_timeout требует JobQueue, которая отключена, поэтому диалог
+        # завершается явно: командой /cancel или кнопкой установки времени напоминаний
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            CallbackQueryHandler(leave_note_for_reminder_time, pattern=SET_REMINDER_TIME_RE),
+        ],
+    ))
+
     # Добавляем базовые обработчики команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("end_work", end_work_command))
     application.add_handler(CommandHandler("break", break_command))
     application.add_handler(CommandHandler("resume", resume_command))
-    application.add_handler(CommandHandler("note", note_command))
     application.add_handler(CommandHandler("my_notes", my_notes_command))
     application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CommandHandler("export", export_command))
@@ -1488,48 +1624,71 @@ def main() -> None:
     application.add_handler(CommandHandler("start_work", start_work_command))
     
     # Обработчик для выбора категорий работы
-    application.add_handler(CallbackQueryHandler(category_callback, pattern=r"^category_"))
+    application.add_handler(CallbackQueryHandler(category_callback, pattern=CATEGORY_RE))
 
     # Обработчик для выбора периода статистики
-    application.add_handler(CallbackQueryHandler(stats_period_callback, pattern=r"^stats_"))
-
-    # Обработчик для выбора категории заметки
-    application.add_handler(CallbackQueryHandler(note_category_callback, pattern=r"^note_category_"))
+    application.add_handler(CallbackQueryHandler(stats_period_callback, pattern=STATS_RE))
 
     # Обработчик для кнопок напоминаний
-    application.add_handler(CallbackQueryHandler(reminders_callback, pattern=r"^reminders_"))
+    application.add_handler(CallbackQueryHandler(reminders_callback, pattern=REMINDERS_RE))
 
     # Обработчик для календаря
-    application.add_handler(CallbackQueryHandler(calendar_callback, pattern=r"^calendar_"))
+    application.add_handler(CallbackQueryHandler(calendar_callback, pattern=CALENDAR_RE))
 
     # Обработчик для управления категориями
-    application.add_handler(CallbackQueryHandler(categories_callback, pattern=r"^show_categories|reload_categories|edit_categories"))
+    application.add_handler(CallbackQueryHandler(categories_callback, pattern=CATEGORIES_RE))
     
-    # Обработчик для ввода времени напоминаний (должен быть первым)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_reminder_time_input))
-
-    # Обработчик для текстовых сообщений (заметки)
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, save_note))
+    # Обработчик текстовых сообщений: время напоминаний или заметка
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
     
-    # Обработчик для инлайн кнопок (должен быть последним)
+    # Обработчики кнопок действий с сессией, заметками и экспортом
+    for callback_data, handler in BUTTON_HANDLERS.items():
+        application.add_handler(
+            CallbackQueryHandler(handler, pattern=re.compile(f"^{re.escape(callback_data)}$"))
+        )
+
+    # Резервный обработчик для инлайн кнопок (должен быть последним)
     application.add_handler(CallbackQueryHandler(button_handler))
     
     # Запускаем бота
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-    # Запускаем фоновые задачи
-    asyncio.create_task(reminder_scheduler(application.bot))
-    asyncio.create_task(categories_monitor())
+    # Бот обрабатывает только сообщения и нажатия на кнопки
+    allowed_updates = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
+    if WEBHOOK_URL:
+        # Telegram сам доставляет обновления, без циклов getUpdates
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urlparse(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=allowed_updates
+        )
+    else:
+        application.run_polling(allowed_updates=allowed_updates)
 
 async def reminder_scheduler(bot) -> None:
     """Фоновая задача для отправки напоминаний."""
     while True:
+        # Событие сбрасывается до проверки, чтобы не потерять изменения во время прохода
+        _reminder_wakeup.clear()
+        last_sweep = time.monotonic()
+        delay = REMINDER_MAX_DELAY
         try:
-            await check_and_send_reminders(bot)
-            await asyncio.sleep(60)  # Проверяем каждые 60 секунд
+            delay = await check_and_send_reminders(bot)
         except Exception as e:
-            logger.error(f"Ошибка в планировщике напоминаний: {e}")
-            await asyncio.sleep(60)
+            logger.error("Ошибка в планировщике напоминаний: %s", e)
+        deadline = time.monotonic() + delay
+
+        try:
+            await asyncio.wait_for(_reminder_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            continue
+
+        # Ждем минимальный интервал между проходами, но не дольше срока ближайшего напоминания
+        wait = min(last_sweep + REMINDER_WAKEUP_MIN_GAP, deadline) - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
 
 async def categories_monitor() -> None:
     """Фоновая задача для мониторинга изменений файла категорий."""
@@ -1544,180 +1703,224 @@ async def categories_monitor() -> None:
             if reload_result.get('loaded_from_file') and not reload_result.get('file_unchanged', False):
                 logger.info("Файл categories.json изменен, категории перезагружены")
             elif reload_result.get('error'):
-                logger.warning(f"Ошибка при мониторинге categories.json: {reload_result.get('error')}")
+                logger.warning("Ошибка при мониторинге categories.json: %s", reload_result.get('error'))
 
         except Exception as e:
-            logger.error(f"Ошибка в мониторинге категорий: {e}")
+            logger.error("Ошибка в мониторинге категорий: %s", e)
             await asyncio.sleep(300)
 
-async def check_and_send_reminders(bot) -> None:
-    """Проверка и отправка напоминаний пользователям."""
+async def check_and_send_reminders(bot) -> float:
+    """Проверка и отправка напоминаний пользователям. Возвращает паузу до следующей проверки."""
+    next_check = None
     try:
-        # Получаем всех пользователей
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT user_id FROM users') as cursor:
-                users = [row['user_id'] for row in await cursor.fetchall()]
-
-        for user_id in users:
+        # Текущее время и границы дня вычисляются один раз на весь проход
+        current_time = datetime.datetime.now()
+        today_start = datetime.datetime.combine(current_time.date(), datetime.time.min)
+        today_end = datetime.datetime.combine(current_time.date(), datetime.time.max)
+
+        # Настройки, активные сессии, перерывы и время последних напоминаний
+        # всех пользователей загружаются за один проход по базе
+        candidates = await Database.get_reminder_candidates(today_start, today_end)
+        # Сначала решаем, что отправить, затем отправляем всем пользователям параллельно.
+        # Отправленные напоминания записываются одной транзакцией после прохода
+        to_send: Dict[int, List[Tuple[Any, Any]]] = {}
+        to_log: List[Tuple[int, str, Optional[int]]] = []
+
+        for candidate in candidates:
+            user_id = candidate['user_id']
             try:
-                # Получаем настройки напоминаний пользователя
-                settings = await Database.get_reminder_settings(user_id)
-
-                # Проверяем активную сессию пользователя
-                active_session = await Database.get_active_session(user_id)
+                settings = candidate['settings']
+                active_session = candidate['session']
+                last_reminders = candidate['last_reminders']
+                actions = []
+                logged = []
 
                 if active_session:
-                    session_start = datetime.datetime.fromisoformat(active_session['start_time'])
-                    current_time = datetime.datetime.now()
+                    session_start = active_session.start_time
                     session_duration = (current_time - session_start).total_seconds() / 60  # в минутах
 
                     # Напоминание о работе (если сессия длится слишком долго)
                     if (settings['work_reminder_enabled'] and
                         session_duration >= settings['work_reminder_minutes']):
 
-                        last_reminder = await Database.get_last_reminder_time(user_id, 'work_reminder')
+                        last_reminder = last_reminders.get('work_reminder', datetime.datetime.min)
                         minutes_since_last = (current_time - last_reminder).total_seconds() / 60
 
                         if minutes_since_last >= settings['work_reminder_minutes']:
-                            await send_work_reminder(bot, user_id, active_session)
-                            await Database.log_sent_reminder(user_id, 'work_reminder', active_session['id'])
+                            actions.append((send_work_reminder, active_session))
+                            logged.append((user_id, 'work_reminder', active_session.id))
 
                     # Напоминание о перерыве (если сессия длится слишком долго без перерыва)
                     if (settings['break_reminder_enabled'] and
                         session_duration >= settings['break_reminder_minutes']):
 
                         # Проверяем, был ли перерыв недавно
-                        breaks = await Database.get_session_breaks(active_session['id'])
-                        has_recent_break = any(
-                            datetime.datetime.fromisoformat(b['start_time']) > current_time - datetime.timedelta(minutes=settings['break_reminder_minutes'])
-                            for b in breaks if b['start_time']
+                        last_break = candidate['last_break']
+                        has_recent_break = (
+                            last_break is not None and
+                            last_break > current_time - datetime.timedelta(minutes=settings['break_reminder_minutes'])
                         )
 
                         if not has_recent_break:
-                            last_reminder = await Database.get_last_reminder_time(user_id, 'break_reminder')
+                            last_reminder = last_reminders.get('break_reminder', datetime.datetime.min)
                             minutes_since_last = (current_time - last_reminder).total_seconds() / 60
 
                             if minutes_since_last >= settings['break_reminder_minutes']:
-                                await send_break_reminder(bot, user_id, active_session)
-                                await Database.log_sent_reminder(user_id, 'break_reminder', active_session['id'])
+                                actions.append((send_break_reminder, active_session))
+                                logged.append((user_id, 'break_reminder', active_session.id))
 
                     # Напоминание о длинном перерыве (если сессия очень долгая)
                     if (settings['long_break_reminder_enabled'] and
                         session_duration >= settings['long_break_reminder_minutes']):
 
-                        last_reminder = await Database.get_last_reminder_time(user_id, 'long_break_reminder')
+                        last_reminder = last_reminders.get('long_break_reminder', datetime.datetime.min)
                         minutes_since_last = (current_time - last_reminder).total_seconds() / 60
 
                         if minutes_since_last >= settings['long_break_reminder_minutes']:
-                            await send_long_break_reminder(bot, user_id, active_session)
-                            await Database.log_sent_reminder(user_id, 'long_break_reminder', active_session['id'])
+                            actions.append((send_long_break_reminder, active_session))
+                            logged.append((user_id, 'long_break_reminder', active_session.id))
 
                 # Напоминание о ежедневной цели
                 if settings['daily_goal_enabled']:
-                    today_start = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
-                    today_end = datetime.datetime.combine(datetime.date.today(), datetime.time.max)
-
-                    daily_sessions = await Database.get_sessions_by_timeframe(user_id, today_start, today_end)
-                    daily_duration = sum(s['duration'] for s in daily_sessions if s['duration'])
+                    daily_duration = candidate['daily_duration']
 
                     if daily_duration >= settings['daily_goal_minutes'] * 60:  # переводим в секунды
-                        last_reminder = await Database.get_last_reminder_time(user_id, 'daily_goal')
-                        minutes_since_last = (datetime.datetime.now() - last_reminder).total_seconds() / 60
+                        last_reminder = last_reminders.get('daily_goal', datetime.datetime.min)
+                        minutes_since_last = (current_time - last_reminder).total_seconds() / 60
 
                         if minutes_since_last >= 60:  # Напоминаем раз в час после достижения цели
-                            await send_daily_goal_reminder(bot, user_id, daily_duration)
-                            await Database.log_sent_reminder(user_id, 'daily_goal')
+                            actions.append((send_daily_goal_reminder, daily_duration))
+                            logged.append((user_id, 'daily_goal', None))
+
+                if actions:
+                    to_send[user_id] = actions
+                    to_log.extend(logged)
+
+                # Только что отправленные напоминания сдвигают следующий срок
+                sent = {reminder_type: current_time for _, reminder_type, _ in logged}
+                due = _next_reminder_due(candidate, {**last_reminders, **sent})
+                if due is not None and (next_check is None or due < next_check):
+                    next_check = due
 
             except Exception as e:
-                logger.error(f"Ошибка при проверке напоминаний для пользователя {user_id}: {e}")
+                logger.error("Ошибка при проверке напоминаний для пользователя %s: %s", user_id, e)
+
+        semaphore = asyncio.Semaphore(REMINDER_SEND_CONCURRENCY)
+        await asyncio.gather(
+            *(_send_user_reminders(bot, user_id, actions, semaphore) for user_id, actions in to_send.items()),
+            return_exceptions=True
+        )
+        await Database.log_sent_reminders(to_log)
 
     except Exception as e:
-        logger.error(f"Ошибка при получении списка пользователей: {e}")
+        logger.error("Ошибка при получении списка пользователей: %s", e)
+
+    if next_check is None:
+        return REMINDER_MAX_DELAY
+    delay = (next_check - datetime.datetime.now()).total_seconds()
+    return min(max(delay, REMINDER_MIN_DELAY), REMINDER_MAX_DELAY)
+
+def _next_reminder_due(candidate: ReminderCandidate, last_reminders: Dict[str, datetime.datetime]) -> Optional[datetime.datetime]:
+    """Ближайшее время, когда пользователю может понадобиться напоминание."""
+    settings = candidate['settings']
+    session = candidate['session']
+    deadlines = []
+
+    if session:
+        for reminder_type, enabled, minutes in (
+            ('work_reminder', 'work_reminder_enabled', 'work_reminder_minutes'),
+            ('break_reminder', 'break_reminder_enabled', 'break_reminder_minutes'),
+            ('long_break_reminder', 'long_break_reminder_enabled', 'long_break_reminder_minutes'),
+        ):
+            if not settings[enabled]:
+                continue
+            interval = datetime.timedelta(minutes=settings[minutes])
+            # Срок наступает, когда истекли все пороги: длительность сессии и пауза после прошлого напоминания
+            starts = [session.start_time, last_reminders.get(reminder_type, datetime.datetime.min)]
+            if reminder_type == 'break_reminder' and candidate['last_break'] is not None:
+                starts.append(candidate['last_break'])
+            deadlines.append(max(starts) + interval)
+
+    # Цель дня меняется только при завершении сессии, а оно будит планировщик
+    if (settings['daily_goal_enabled'] and
+        candidate['daily_duration'] >= settings['daily_goal_minutes'] * 60):
+        last_reminder = last_reminders.get('daily_goal', datetime.datetime.min)
+        deadlines.append(last_reminder + datetime.timedelta(minutes=60))
+
+    return min(deadlines, default=None)
+
+async def _send_user_reminders(
+    bot, user_id: int, actions: List[Tuple[Any, Any]], semaphore: asyncio.Semaphore
+) -> None:
+    """Отправка напоминаний одному пользователю по порядку."""
+    for send_reminder, arg in actions:
+        async with semaphore:
+            await send_reminder(bot, user_id, arg)
 
 async def send_work_reminder(bot, user_id: int, session) -> None:
     """Отправка напоминания о длительной работе."""
     try:
-        keyboard = [
-            [InlineKeyboardButton("⏸️ Сделать перерыв", callback_data=CB_BREAK_WORK)],
-            [InlineKeyboardButton("⏹️ Завершить работу", callback_data=CB_END_WORK)]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         await bot.send_message(
             chat_id=user_id,
             text=(
                 "💼 <b>Напоминание о работе</b>\n\n"
                 "Вы работаете уже довольно долго. Рекомендуется сделать перерыв!\n\n"
-                f"Категория: {session['category']}\n"
+                f"Категория: {session.category}\n"
                 "Используйте кнопки ниже для действий."
             ),
-            reply_markup=reply_markup,
+            reply_markup=KB_WORK_REMINDER,
             parse_mode="HTML"
         )
     except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания о работе пользователю {user_id}: {e}")
+        logger.error("Ошибка при отправке напоминания о работе пользователю %s: %s", user_id, e)
 
 async def send_break_reminder(bot, user_id: int, session) -> None:
     """Отправка напоминания о перерыве."""
     try:
-        keyboard = [
-            [InlineKeyboardButton("⏸️ Сделать перерыв", callback_data=CB_BREAK_WORK)]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         await bot.send_message(
             chat_id=user_id,
             text=(
                 "☕ <b>Рекомендация перерыва</b>\n\n"
                 "Вы работаете уже некоторое время. Самое время сделать небольшой перерыв!\n\n"
-                f"Категория: {session['category']}"
+                f"Категория: {session.category}"
             ),
-            reply_markup=reply_markup,
+            reply_markup=KB_BREAK_REMINDER,
             parse_mode="HTML"
         )
     except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания о перерыве пользователю {user_id}: {e}")
+        logger.error("Ошибка при отправке напоминания о перерыве пользователю %s: %s", user_id, e)
 
 async def send_long_break_reminder(bot, user_id: int, session) -> None:
     """Отправка напоминания о длинном перерыве."""
     try:
-        keyboard = [
-            [InlineKeyboardButton("⏸️ Сделать длинный перерыв", callback_data=CB_BREAK_WORK)]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         await bot.send_message(
             chat_id=user_id,
             text=(
                 "⏰ <b>Рекомендация длинного перерыва</b>\n\n"
                 "Вы работаете уже очень долго! Рекомендуется сделать более длительный перерыв для отдыха.\n\n"
-                f"Категория: {session['category']}"
+                f"Категория: {session.category}"
             ),
-            reply_markup=reply_markup,
+            reply_markup=KB_LONG_BREAK_REMINDER,
             parse_mode="HTML"
         )
     except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания о длинном перерыве пользователю {user_id}: {e}")
+        logger.error("Ошибка при отправке напоминания о длинном перерыве пользователю %s: %s", user_id, e)
 
 async def send_daily_goal_reminder(bot, user_id: int, daily_duration: int) -> None:
     """Отправка напоминания о достижении ежедневной цели."""
     try:
-        hours, remainder = divmod(daily_duration, 3600)
-        minutes, seconds = divmod(remainder, 60)
-
         await bot.send_message(
             chat_id=user_id,
             text=(
                 "🎯 <b>Поздравляем!</b>\n\n"
                 "Вы достигли своей ежедневной цели по времени работы!\n\n"
-                f"Сегодня отработано: {hours}ч {minutes}м\n"
+                f"Сегодня отработано: {_fmt_hm(daily_duration)}\n"
                 "Отличная работа! Продолжайте в том же духе или завершите рабочий день."
             ),
             parse_mode="HTML"
         )
     except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания о цели пользователю {user_id}: {e}")
+        logger.error("Ошибка при отправке напоминания о цели пользователю %s: %s", user_id, e)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок."""
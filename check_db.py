@@ -1,48 +1,61 @@
+import calendar
 import sqlite3
 import os
 from datetime import datetime
 
-def check_db():
+from database import SQLITE_PRAGMAS
+
+def _connect() -> sqlite3.Connection:
+    """Соединение с базой данных с теми же настройками, что и у бота."""
     conn = sqlite3.connect('work_tracker.db')
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _print_rows(cursor: sqlite3.Cursor, query: str) -> None:
+    """Построчный вывод результата запроса (таблица не загружается в память целиком)."""
+    for row in cursor.execute(query):
+        print(dict(row))
+
+def check_db():
+    conn = _connect()
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
     print("=== USERS ===")
-    cursor.execute("SELECT * FROM users")
-    users = cursor.fetchall()
-    for user in users:
-        print(dict(user))
+    _print_rows(cursor, "SELECT * FROM users")
     
     print("\n=== SESSIONS ===")
-    cursor.execute("SELECT * FROM sessions")
-    sessions = cursor.fetchall()
-    for session in sessions:
-        session_dict = dict(session)
-        print(session_dict)
+    _print_rows(cursor, "SELECT * FROM sessions")
     
     print("\n=== BREAKS ===")
     try:
-        cursor.execute("SELECT * FROM breaks")
-        breaks = cursor.fetchall()
-        for break_item in breaks:
-            print(dict(break_item))
+        _print_rows(cursor, "SELECT * FROM breaks")
     except sqlite3.OperationalError:
         print("Таблица breaks еще не создана")
     
     conn.close()
 
 def fix_sessions():
-    conn = sqlite3.connect('work_tracker.db')
+    conn = _connect()
     cursor = conn.cursor()
     
+    # Время окончания одно для всех сессий. Секунды считаются так же, как
+    # strftime('%s') считает start_time (локальное время без часового пояса)
+    now = datetime.now()
+    now_seconds = calendar.timegm(now.timetuple())
+
+    # Блокировка записи берется сразу, а не при первом изменении
+    cursor.execute("BEGIN IMMEDIATE")
+
     # Устанавливаем все активные сессии в завершенные
     cursor.execute("""
         UPDATE sessions 
         SET status = 'completed', 
             end_time = ?, 
-            duration = strftime('%s', ?) - strftime('%s', start_time) 
+            duration = ? - strftime('%s', start_time) 
         WHERE status IN ('active', 'paused')
-    """, (datetime.now(), datetime.now()))
+    """, (now, now_seconds))
     
     print(f"Исправлено сессий: {cursor.rowcount}")
     
@@ -6,7 +6,7 @@
 import os
 import json
 import datetime
-from typing import List, Dict, Any
+from typing import Dict, Any, Tuple
 from dotenv import load_dotenv
 
 # Загрузка переменных из .env файла
@@ -18,6 +18,13 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 # Путь к базе данных SQLite
 DATABASE_PATH = os.getenv("DATABASE_PATH", "work_tracker.db")
 
+# Webhook вместо long polling (если задан WEBHOOK_URL).
+# Требует python-telegram-bot[webhooks]
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+
 # Настройки рабочего дня (в часах)
 WORK_DAY_START = 9  # 09:00
 WORK_DAY_END = 18  # 18:00
@@ -26,13 +33,21 @@ LUNCH_BREAK_END = 14  # 14:00
 WORK_DAY_HOURS = 8  # Стандартная продолжительность рабочего дня
 
 # Глобальные переменные для категорий
-_work_categories: List[str] = []
-_note_categories: List[str] = []
+# Категории хранятся кортежами: геттеры отдают их без копирования,
+# а изменить общее состояние через возвращенное значение нельзя
+DEFAULT_WORK_CATEGORIES = ("Разработка", "Совещания", "Документация", "Обучение", "Другое")
+DEFAULT_NOTE_CATEGORIES = ("Общее", "Идея", "Задача", "Проблема", "Встреча", "Личное")
+
+_work_categories: Tuple[str, ...] = ()
+_note_categories: Tuple[str, ...] = ()
 _last_file_mtime: float = 0.0
+# Счётчик версий категорий: увеличивается при каждой фактической загрузке
+_categories_version: int = 0
+_last_load_time: str = ""
 
 def load_categories() -> Dict[str, Any]:
     """Загрузка категорий из JSON файла."""
-    global _work_categories, _note_categories, _last_file_mtime
+    global _work_categories, _note_categories, _last_file_mtime, _categories_version, _last_load_time
 
     categories_file = 'categories.json'
 
@@ -52,6 +67,10 @@ def load_categories() -> Dict[str, Any]:
         # Файл не существует или недоступен
         current_mtime = 0
 
+    # Дальше категории будут перечитаны (или заменены значениями по умолчанию)
+    _categories_version += 1
+    _last_load_time = datetime.datetime.now().isoformat()
+
     try:
         if os.path.exists(categories_file):
             with open(categories_file, 'r', encoding='utf-8') as f:
@@ -63,16 +82,16 @@ def load_categories() -> Dict[str, Any]:
 
             # Валидация данных
             if isinstance(work_cats, list) and len(work_cats) > 0:
-                _work_categories = work_cats
+                _work_categories = tuple(work_cats)
             else:
                 print("Предупреждение: некорректные категории работы в categories.json, используются значения по умолчанию")
-                _work_categories = ["Разработка", "Совещания", "Документация", "Обучение", "Другое"]
+                _work_categories = DEFAULT_WORK_CATEGORIES
 
             if isinstance(note_cats, list) and len(note_cats) > 0:
-                _note_categories = note_cats
+                _note_categories = tuple(note_cats)
             else:
                 print("Предупреждение: некорректные категории заметок в categories.json, используются значения по умолчанию")
-                _note_categories = ["Общее", "Идея", "Задача", "Проблема", "Встреча", "Личное"]
+                _note_categories = DEFAULT_NOTE_CATEGORIES
 
             return {
                 'work_categories': _work_categories,
@@ -83,8 +102,8 @@ def load_categories() -> Dict[str, Any]:
             # Файл не существует, создаем с значениями по умолчанию
             print("Файл categories.json не найден, создаем с значениями по умолчанию")
             default_data = {
-                "work_categories": ["Разработка", "Совещания", "Документация", "Обучение", "Другое"],
-                "note_categories": ["Общее", "Идея", "Задача", "Проблема", "Встреча", "Личное"],
+                "work_categories": list(DEFAULT_WORK_CATEGORIES),
+                "note_categories": list(DEFAULT_NOTE_CATEGORIES),
                 "version": "1.0",
                 "last_updated": datetime.datetime.now().isoformat() + "Z"
             }
@@ -92,8 +111,8 @@ def load_categories() -> Dict[str, Any]:
             with open(categories_file, 'w', encoding='utf-8') as f:
                 json.dump(default_data, f, ensure_ascii=False, indent=2)
 
-            _work_categories = default_data['work_categories']
-            _note_categories = default_data['note_categories']
+            _work_categories = DEFAULT_WORK_CATEGORIES
+            _note_categories = DEFAULT_NOTE_CATEGORIES
 
             return {
                 'work_categories': _work_categories,
@@ -105,8 +124,8 @@ def load_categories() -> Dict[str, Any]:
     except json.JSONDecodeError as e:
         print(f"Ошибка парсинга JSON в categories.json: {e}")
         print("Используются значения по умолчанию")
-        _work_categories = ["Разработка", "Совещания", "Документация", "Обучение", "Другое"]
-        _note_categories = ["Общее", "Идея", "Задача", "Проблема", "Встреча", "Личное"]
+        _work_categories = DEFAULT_WORK_CATEGORIES
+        _note_categories = DEFAULT_NOTE_CATEGORIES
 
         return {
             'work_categories': _work_categories,
@@ -118,8 +137,8 @@ def load_categories() -> Dict[str, Any]:
     except Exception as e:
         print(f"Ошибка загрузки categories.json: {e}")
         print("Используются значения по умолчанию")
-        _work_categories = ["Разработка", "Совещания", "Документация", "Обучение", "Другое"]
-        _note_categories = ["Общее", "Идея", "Задача", "Проблема", "Встреча", "Личное"]
+        _work_categories = DEFAULT_WORK_CATEGORIES
+        _note_categories = DEFAULT_NOTE_CATEGORIES
 
         return {
             'work_categories': _work_categories,
@@ -128,17 +147,23 @@ def load_categories() -> Dict[str, Any]:
             'error': True
         }
 
-def get_work_categories() -> List[str]:
+def get_work_categories() -> Tuple[str, ...]:
     """Получение списка категорий работы."""
     if not _work_categories:
         load_categories()
-    return _work_categories.copy()
+    return _work_categories
 
-def get_note_categories() -> List[str]:
+def get_note_categories() -> Tuple[str, ...]:
     """Получение списка категорий заметок."""
     if not _note_categories:
         load_categories()
-    return _note_categories.copy()
+    return _note_categories
+
+def get_categories_version() -> int:
+    """Версия категорий, меняется при каждой перезагрузке (для кэшей клавиатур)."""
+    if not _work_categories or not _note_categories:
+        load_categories()
+    return _categories_version
 
 def reload_categories() -> Dict[str, Any]:
     """Перезагрузка категорий из файла."""
@@ -146,9 +171,11 @@ def reload_categories() -> Dict[str, Any]:
 
 def get_categories_info() -> Dict[str, Any]:
     """Получение полной информации о категориях."""
+    if not _work_categories or not _note_categories:
+        load_categories()
     return {
-        'work_categories': get_work_categories(),
-        'note_categories': get_note_categories(),
+        'work_categories': _work_categories,
+        'note_categories': _note_categories,
         'file_path': 'categories.json',
-        'last_load_time': datetime.datetime.now().isoformat()
+        'last_load_time': _last_load_time
     }
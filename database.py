@@ -3,12 +3,21 @@
 Реализует асинхронные операции с использованием aiosqlite.
 """
 
+import asyncio
+import contextlib
+import csv
+import dataclasses
+import io
+import logging
+import sqlite3
 import aiosqlite
 import datetime
-from typing import Optional, Dict, List, Any, Union
+from typing import Optional, Dict, List, Any, Union, Tuple, TypedDict, AsyncIterator
 
 from config import DATABASE_PATH
 
+logger = logging.getLogger(__name__)
+
 # Статусы рабочих сессий
 SESSION_STATUS = {
     "ACTIVE": "active",      # Активная сессия
@@ -16,13 +25,489 @@ SESSION_STATUS = {
     "COMPLETED": "completed" # Завершенная сессия
 }
 
+@dataclasses.dataclass(slots=True, frozen=True)
+class Session:
+    """Рабочая сессия пользователя (строка таблицы sessions)."""
+    id: int
+    user_id: int
+    start_time: datetime.datetime
+    end_time: Optional[datetime.datetime]
+    duration: Optional[int]
+    status: str
+    category: str
+
+class CategoryStats(TypedDict):
+    """Статистика по одной категории работы."""
+    count: int
+    duration: int
+
+class DailyStats(TypedDict):
+    """Статистика за день."""
+    date: str
+    total_sessions: int
+    total_duration: int
+    total_breaks: int
+    break_duration: int
+    categories: Dict[str, CategoryStats]
+    completed_sessions: int
+    active_sessions: int
+
+class WeeklyStats(TypedDict):
+    """Статистика за неделю."""
+    start_date: str
+    end_date: str
+    total_sessions: int
+    total_duration: int
+    total_breaks: int
+    break_duration: int
+    categories: Dict[str, CategoryStats]
+    daily_stats: List[DailyStats]
+
+class MonthlyStats(TypedDict):
+    """Статистика за месяц."""
+    year: int
+    month: int
+    month_name: str
+    total_sessions: int
+    total_duration: int
+    total_breaks: int
+    break_duration: int
+    categories: Dict[str, CategoryStats]
+    weekly_stats: List[WeeklyStats]
+
+class ReminderCandidate(TypedDict):
+    """Данные одного пользователя для проверки напоминаний."""
+    user_id: int
+    settings: Dict[str, Any]
+    session: Optional[Session]
+    last_break: Optional[datetime.datetime]
+    daily_duration: int
+    last_reminders: Dict[str, datetime.datetime]
+
+def _convert_timestamp(value: bytes) -> Union[datetime.datetime, str]:
+    """Преобразование значения колонки TIMESTAMP в datetime."""
+    text = value.decode()
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return text
+
+# Колонки TIMESTAMP читаются сразу как datetime, обработчикам не нужно разбирать строки
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", _convert_timestamp)
+
+def _build_user_data_csv(
+    user: sqlite3.Row,
+    sessions: List[sqlite3.Row],
+    notes: List[sqlite3.Row],
+    breaks: List[sqlite3.Row]
+) -> bytes:
+    """Формирование CSV с данными пользователя (содержимое файла в UTF-8)."""
+    csvfile = io.StringIO(newline='')
+    writer = csv.writer(csvfile)
+
+    # Лист 1: Информация о пользователе
+    writer.writerow(['ЛИСТ 1: ИНФОРМАЦИЯ О ПОЛЬЗОВАТЕЛЕ'])
+    writer.writerow(['ID пользователя', 'Имя', 'Фамилия', 'Username'])
+    writer.writerow([
+        user['user_id'],
+        user['first_name'] or '',
+        user['last_name'] or '',
+        user['username'] or ''
+    ])
+    writer.writerow([])  # Пустая строка
+
+    # Лист 2: Рабочие сессии
+    writer.writerow(['ЛИСТ 2: РАБОЧИЕ СЕССИИ'])
+    writer.writerow([
+        'ID сессии', 'Дата начала', 'Дата окончания',
+        'Продолжительность (сек)', 'Категория', 'Статус'
+    ])
+
+    for session in sessions:
+        writer.writerow([
+            session['id'],
+            session['start_time'],
+            session['end_time'] or '',
+            session['duration'] or 0,
+            session['category'],
+            session['status']
+        ])
+    writer.writerow([])  # Пустая строка
+
+    # Лист 3: Заметки
+    writer.writerow(['ЛИСТ 3: ЗАМЕТКИ'])
+    writer.writerow([
+        'ID заметки', 'Текст заметки', 'Дата создания',
+        'Категория сессии'
+    ])
+
+    for note in notes:
+        writer.writerow([
+            note['id'],
+            note['content'],
+            note['timestamp'],
+            note['session_category']
+        ])
+    writer.writerow([])  # Пустая строка
+
+    # Лист 4: Перерывы
+    writer.writerow(['ЛИСТ 4: ПЕРЕРЫВЫ'])
+    writer.writerow([
+        'ID перерыва', 'ID сессии', 'Дата начала', 'Дата окончания',
+        'Продолжительность (сек)', 'Причина'
+    ])
+
+    for break_item in breaks:
+        writer.writerow([
+            break_item['id'],
+            break_item['session_id'],
+            break_item['start_time'],
+            break_item['end_time'] or '',
+            break_item['duration'] or 0,
+            break_item['reason']
+        ])
+
+    return csvfile.getvalue().encode('utf-8')
+
+def _build_sessions_csv(
+    user_id: int,
+    sessions: List[Dict[str, Any]],
+    start_date: Optional[str],
+    end_date: Optional[str]
+) -> bytes:
+    """Формирование CSV-отчета по сессиям (содержимое файла в UTF-8)."""
+    csvfile = io.StringIO(newline='')
+    writer = csv.writer(csvfile)
+
+    # Заголовок
+    writer.writerow(['ОТЧЕТ ПО РАБОЧИМ СЕССИЯМ'])
+    writer.writerow([f'Пользователь ID: {user_id}'])
+    if start_date and end_date:
+        writer.writerow([f'Период: с {start_date} по {end_date}'])
+    writer.writerow([])  # Пустая строка
+
+    # Заголовки колонок
+    writer.writerow([
+        'Дата', 'Время начала', 'Время окончания',
+        'Продолжительность', 'Категория', 'Статус'
+    ])
+
+    # Данные сессий
+    total_duration = 0
+    for session in sessions:
+        start_time = session['start_time']
+        end_time_str = session['end_time'] if session['end_time'] else 'Не завершена'
+
+        if session['end_time']:
+            duration = session['duration']
+            total_duration += duration
+        else:
+            duration = 'Не завершена'
+
+        writer.writerow([
+            start_time.strftime('%Y-%m-%d'),
+            start_time.strftime('%H:%M:%S'),
+            end_time_str,
+            duration,
+            session['category'],
+            session['status']
+        ])
+
+    writer.writerow([])  # Пустая строка
+
+    # Итоговая статистика
+    writer.writerow(['ИТОГО:'])
+    if sessions:
+        hours, remainder = divmod(total_duration, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        writer.writerow([f'Общее время работы: {hours}ч {minutes}м {seconds}с'])
+        writer.writerow([f'Количество сессий: {len(sessions)}'])
+
+    return csvfile.getvalue().encode('utf-8')
+
+def _write_bytes(file_path: str, data: bytes) -> None:
+    """Запись данных в файл (выполняется в отдельном потоке)."""
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+# Настройки SQLite для общего соединения: WAL позволяет читать во время записи,
+# synchronous=NORMAL убирает лишние fsync при каждом коммите,
+# mmap_size позволяет читать страницы файла без копирования (до 256 МБ),
+# busy_timeout ждет блокировку других процессов (например, check_db.py) вместо ошибки
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=30000",
+)
+
+# Флаги включения напоминаний в таблице reminder_settings
+REMINDER_FLAG_COLUMNS = (
+    "work_reminder_enabled",
+    "break_reminder_enabled",
+    "long_break_reminder_enabled",
+    "daily_goal_enabled",
+)
+
+# Настройки напоминаний для пользователей, которые их еще не меняли
+DEFAULT_REMINDER_SETTINGS = {
+    'work_reminder_enabled': 1,
+    'work_reminder_minutes': 60,
+    'break_reminder_enabled': 1,
+    'break_reminder_minutes': 15,
+    'long_break_reminder_enabled': 1,
+    'long_break_reminder_minutes': 120,
+    'daily_goal_enabled': 0,
+    'daily_goal_minutes': 480,
+}
+
+# Все изменения данных проходят через одного писателя: транзакции разных
+# обработчиков на общем соединении не перемешиваются
+_write_lock = asyncio.Lock()
+
+# Общие долгоживущие соединения, открываются при первом обращении: _db для записи,
+# _read_db для чтения. В режиме WAL читатель на отдельном соединении видит только
+# зафиксированные данные и не попадает внутрь чужой незавершенной транзакции
+_db: Optional[aiosqlite.Connection] = None
+_read_db: Optional[aiosqlite.Connection] = None
+_db_lock = asyncio.Lock()
+
+# Размер кэша подготовленных выражений соединения: все запросы из _SQL,
+# проверки напоминаний и экспорта остаются подготовленными между вызовами
+SQLITE_CACHED_STATEMENTS = 256
+
+async def _open_db() -> aiosqlite.Connection:
+    """Открытие соединения с базой данных с общими настройками."""
+    db = await aiosqlite.connect(
+        DATABASE_PATH,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        cached_statements=SQLITE_CACHED_STATEMENTS
+    )
+    db.row_factory = aiosqlite.Row
+    for pragma in SQLITE_PRAGMAS:
+        # База в памяти не поддерживает WAL
+        if DATABASE_PATH == ":memory:" and "journal_mode" in pragma:
+            continue
+        await db.execute(pragma)
+    return db
+
+async def _get_db() -> aiosqlite.Connection:
+    """Получение общего соединения для записи."""
+    global _db
+    if _db is None:
+        async with _db_lock:
+            if _db is None:
+                _db = await _open_db()
+    return _db
+
+async def _get_read_db() -> aiosqlite.Connection:
+    """Получение общего соединения для чтения."""
+    global _read_db
+    if _read_db is None:
+        # Таблицы и режим WAL создаются через соединение записи
+        await _get_db()
+        async with _db_lock:
+            if _read_db is None:
+                db = await _open_db()
+                await db.execute("PRAGMA query_only = ON")
+                _read_db = db
+    return _read_db
+
+@contextlib.asynccontextmanager
+async def _connect() -> AsyncIterator[aiosqlite.Connection]:
+    """Соединение для чтения (не закрывается): видны только зафиксированные данные."""
+    if DATABASE_PATH == ":memory:":
+        # База в памяти существует только внутри одного соединения,
+        # поэтому чтение ждет завершения текущей транзакции записи
+        async with _write_lock:
+            yield await _get_db()
+    else:
+        yield await _get_read_db()
+
+
+@contextlib.asynccontextmanager
+async def _transaction() -> AsyncIterator[aiosqlite.Connection]:
+    """Транзакция записи: фиксируется при успехе и откатывается при ошибке."""
+    async with _write_lock:
+        db = await _get_db()
+        # Блокировка записи берется сразу: чтение и изменение внутри транзакции
+        # не упрутся в SQLITE_BUSY при повышении блокировки
+        if not db.in_transaction:
+            await db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
+
+# Пакетная запись заметок: заметки копятся в очереди и записываются
+# одним executemany не реже, чем раз в NOTE_BATCH_DELAY секунд
+NOTE_BATCH_SIZE = 50
+NOTE_BATCH_DELAY = 0.05
+
+_note_queue: Optional[asyncio.Queue] = None
+_note_writer_task: Optional[asyncio.Task] = None
+
+# Запросы горячего пути. Каждый запрос задан одной строкой, поэтому sqlite3
+# находит уже подготовленное выражение в кэше соединения, а не разбирает SQL заново
+_SQL = {
+    "get_open_session": 'SELECT * FROM sessions WHERE user_id = ? AND status IN (?, ?)',
+    "get_session_id_by_status": 'SELECT id FROM sessions WHERE user_id = ? AND status = ?',
+    # Новая сессия создается, только если у пользователя нет открытой (проверка и вставка атомарны)
+    "insert_session": '''
+        INSERT INTO sessions (user_id, start_time, status, category)
+        SELECT ?, ?, ?, ?
+        WHERE NOT EXISTS (SELECT 1 FROM sessions WHERE user_id = ? AND status IN (?, ?))
+    ''',
+    "insert_note": 'INSERT INTO notes (user_id, session_id, content, category) VALUES (?, ?, ?, ?)',
+    "insert_note_with_time": (
+        'INSERT INTO notes (user_id, session_id, content, category, timestamp) VALUES (?, ?, ?, ?, ?)'
+    ),
+    "get_session_breaks": 'SELECT * FROM breaks WHERE session_id = ? ORDER BY start_time ASC',
+    "get_user_notes": '''
+        SELECT n.id, substr(n.content, 1, 100) AS content,
+               length(n.content) AS content_len, n.timestamp, n.category,
+               s.category as session_category, s.start_time, s.status
+        FROM notes n
+        JOIN sessions s ON n.session_id = s.id
+        WHERE n.user_id = ?
+        ORDER BY n.timestamp DESC
+        LIMIT ?
+    ''',
+    # Сессии относятся к периоду по времени начала, как в статистике: сессия через
+    # полночь не попадает в два дня, а у открытой сессии еще нет длительности
+    "get_sessions_by_timeframe": '''
+        SELECT * FROM sessions
+        WHERE user_id = ? AND status = ? AND start_time >= ? AND start_time <= ?
+        ORDER BY start_time ASC
+    ''',
+    "has_any_sessions": 'SELECT EXISTS(SELECT 1 FROM sessions WHERE user_id = ?)',
+    "get_total_duration": '''
+        SELECT COALESCE(SUM(duration), 0)
+        FROM sessions
+        WHERE user_id = ? AND start_time >= ? AND start_time <= ?
+    ''',
+    "get_daily_durations": '''
+        SELECT CAST(strftime('%d', start_time) AS INTEGER) AS day, SUM(duration) AS total_duration
+        FROM sessions
+        WHERE user_id = ? AND status = ? AND start_time >= ? AND start_time < ?
+        GROUP BY date(start_time)
+    ''',
+    # Агрегаты статистики за период: считаются в SQL без загрузки сессий и перерывов
+    "period_categories": '''
+        SELECT category, COUNT(*) AS count, COALESCE(SUM(duration), 0) AS duration
+        FROM sessions
+        WHERE user_id = ? AND status = ? AND start_time >= ? AND start_time <= ?
+        GROUP BY category
+        ORDER BY MAX(start_time) DESC
+    ''',
+    "period_session_counts": '''
+        SELECT COUNT(*) AS total_sessions, COALESCE(SUM(status IN (?, ?)), 0) AS active_sessions
+        FROM sessions
+        WHERE user_id = ? AND start_time >= ? AND start_time <= ?
+    ''',
+    "period_breaks": '''
+        SELECT COUNT(*) AS total_breaks,
+               COALESCE(SUM(CASE WHEN b.end_time IS NOT NULL THEN b.duration END), 0) AS break_duration
+        FROM breaks b
+        JOIN sessions s ON s.id = b.session_id
+        WHERE s.user_id = ? AND s.start_time >= ? AND s.start_time <= ?
+    ''',
+    # Те же агрегаты с разбивкой по дням: неделя и месяц считаются одним проходом
+    "daily_categories": '''
+        SELECT date(start_time) AS day, category, COUNT(*) AS count, COALESCE(SUM(duration), 0) AS duration
+        FROM sessions
+        WHERE user_id = ? AND status = ? AND start_time >= ? AND start_time <= ?
+        GROUP BY day, category
+        ORDER BY day, MAX(start_time) DESC
+    ''',
+    "daily_session_counts": '''
+        SELECT date(start_time) AS day, COUNT(*) AS total_sessions,
+               COALESCE(SUM(status IN (?, ?)), 0) AS active_sessions
+        FROM sessions
+        WHERE user_id = ? AND start_time >= ? AND start_time <= ?
+        GROUP BY day
+    ''',
+    "daily_breaks": '''
+        SELECT date(s.start_time) AS day, COUNT(*) AS total_breaks,
+               COALESCE(SUM(CASE WHEN b.end_time IS NOT NULL THEN b.duration END), 0) AS break_duration
+        FROM breaks b
+        JOIN sessions s ON s.id = b.session_id
+        WHERE s.user_id = ? AND s.start_time >= ? AND s.start_time <= ?
+        GROUP BY day
+    ''',
+    # Проверка напоминаний: данные всех пользователей за проход читаются
+    # несколькими запросами вместо отдельных запросов на каждого пользователя.
+    # Напоминание возможно только при открытой сессии или включенной цели дня
+    "reminder_users": '''
+        SELECT u.user_id, rs.user_id IS NOT NULL AS has_settings,
+               rs.work_reminder_enabled, rs.work_reminder_minutes,
+               rs.break_reminder_enabled, rs.break_reminder_minutes,
+               rs.long_break_reminder_enabled, rs.long_break_reminder_minutes,
+               rs.daily_goal_enabled, rs.daily_goal_minutes,
+               s.id AS session_id, s.start_time, s.end_time, s.duration, s.status, s.category
+        FROM users u
+        LEFT JOIN reminder_settings rs ON rs.user_id = u.user_id
+        LEFT JOIN sessions s ON s.user_id = u.user_id AND s.status IN (?, ?)
+        WHERE s.id IS NOT NULL OR rs.daily_goal_enabled = 1
+    ''',
+    "reminder_daily_durations": '''
+        SELECT user_id, COALESCE(SUM(duration), 0) AS duration
+        FROM sessions
+        WHERE start_time >= ? AND start_time <= ?
+        GROUP BY user_id
+    ''',
+    # Время берется обычной колонкой из строки с MAX (так SQLite выполняет
+    # агрегат), поэтому к нему применяется конвертер TIMESTAMP
+    "reminder_last_sent": '''
+        SELECT user_id, reminder_type, sent_at, MAX(sent_at)
+        FROM sent_reminders
+        GROUP BY user_id, reminder_type
+    ''',
+    "insert_sent_reminder": 'INSERT INTO sent_reminders (user_id, reminder_type, session_id) VALUES (?, ?, ?)',
+    "reminder_last_breaks": '''
+        SELECT b.session_id, b.start_time, MAX(b.start_time)
+        FROM breaks b
+        JOIN sessions s ON s.id = b.session_id
+        WHERE s.status IN (?, ?)
+        GROUP BY b.session_id
+    ''',
+    # Экспорт в CSV: выбираются только столбцы, которые попадают в файл
+    "export_user": '''
+        SELECT user_id, first_name, last_name, username FROM users WHERE user_id = ?
+    ''',
+    "export_sessions": '''
+        SELECT id, start_time, end_time, duration, category, status
+        FROM sessions
+        WHERE user_id = ?
+        ORDER BY start_time DESC
+    ''',
+    "export_notes": '''
+        SELECT n.id, n.content, n.timestamp, s.category AS session_category
+        FROM notes n
+        JOIN sessions s ON n.session_id = s.id
+        WHERE n.user_id = ?
+        ORDER BY n.timestamp DESC
+    ''',
+    "export_breaks": '''
+        SELECT id, session_id, start_time, end_time, duration, reason
+        FROM breaks
+        WHERE user_id = ?
+        ORDER BY start_time DESC
+    ''',
+}
+
 class Database:
     """Класс для асинхронной работы с базой данных SQLite."""
     
     @staticmethod
     async def init_db() -> None:
         """Инициализация базы данных и создание необходимых таблиц."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _transaction() as db:
             # Создаем таблицу пользователей
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -68,13 +553,13 @@ class Database:
             column_names = [col[1] for col in columns]
 
             if 'category' not in column_names:
-                print("Добавляем колонку category в таблицу notes...")
+                logger.info("Добавляем колонку category в таблицу notes...")
                 await db.execute('ALTER TABLE notes ADD COLUMN category TEXT DEFAULT "Общее"')
-                print("Колонка category успешно добавлена в таблицу notes")
+                logger.info("Колонка category успешно добавлена в таблицу notes")
 
                 # Обновляем существующие записи, чтобы они имели значение по умолчанию
                 await db.execute('UPDATE notes SET category = "Общее" WHERE category IS NULL')
-                print("Обновлены существующие записи в таблице notes")
+                logger.info("Обновлены существующие записи в таблице notes")
             
             # Создаем таблицу перерывов
             await db.execute('''
@@ -125,23 +610,45 @@ class Database:
                 )
             ''')
 
-            await db.commit()
+            # Индексы для проверки напоминаний: открытая сессия пользователя,
+            # последний перерыв сессии и последнее напоминание каждого типа
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_sessions_user_status ON sessions (user_id, status, start_time)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_breaks_session ON breaks (session_id, start_time)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_sent_reminders_lookup ON sent_reminders (user_id, reminder_type, sent_at)'
+            )
+
+            # Индексы для статистики, экспорта и заметок: выборки по пользователю и периоду
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_sessions_user_start ON sessions (user_id, start_time)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_notes_user_ts ON notes (user_id, timestamp)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_notes_session ON notes (session_id, timestamp)'
+            )
+
+            # Статистика для планировщика запросов, чтобы он выбирал подходящие индексы
+            await db.execute('ANALYZE')
     
     @staticmethod
     async def add_user(user_id: int, username: str, first_name: str, last_name: str) -> None:
         """Добавление нового пользователя или обновление информации о существующем."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _transaction() as db:
             await db.execute('''
                 INSERT OR REPLACE INTO users (user_id, username, first_name, last_name)
                 VALUES (?, ?, ?, ?)
             ''', (user_id, username, first_name, last_name))
-            await db.commit()
     
     @staticmethod
     async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
         """Получение информации о пользователе по его ID."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
+        async with _connect() as db:
             async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
                 row = await cursor.fetchone()
                 if row:
@@ -153,30 +660,22 @@ class Database:
         """Начало новой рабочей сессии. Возвращает ID сессии."""
         now = datetime.datetime.now()
         
-        print(f"DEBUG: Создание сессии для пользователя {user_id}, категория: {category}")
+        logger.debug("Создание сессии для пользователя %s, категория: %s", user_id, category)
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            # Проверяем наличие активной или приостановленной сессии
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                'SELECT * FROM sessions WHERE user_id = ? AND status IN (?, ?)', 
-                (user_id, SESSION_STATUS["ACTIVE"], SESSION_STATUS["PAUSED"])
-            ) as cursor:
-                active_session = await cursor.fetchone()
-                
-                if active_session:
-                    print(f"DEBUG: Найдена существующая сессия: {dict(active_session)}")
-                    return -1  # Уже есть активная или приостановленная сессия
-            
-            # Создаем новую сессию
-            cursor = await db.execute('''
-                INSERT INTO sessions (user_id, start_time, status, category)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, now, SESSION_STATUS["ACTIVE"], category))
+        async with _transaction() as db:
+            cursor = await db.execute(
+                _SQL["insert_session"],
+                (
+                    user_id, now, SESSION_STATUS["ACTIVE"], category,
+                    user_id, SESSION_STATUS["ACTIVE"], SESSION_STATUS["PAUSED"]
+                )
+            )
+            if cursor.rowcount == 0:
+                logger.debug("У пользователя %s уже есть открытая сессия", user_id)
+                return -1  # Уже есть активная или приостановленная сессия
             
             session_id = cursor.lastrowid
-            await db.commit()
-            print(f"DEBUG: Создана новая сессия ID: {session_id}")
+            logger.debug("Создана новая сессия ID: %s", session_id)
             return session_id
     
     @staticmethod
@@ -184,9 +683,7 @@ class Database:
         """Завершение активной рабочей сессии. Возвращает информацию о сессии."""
         now = datetime.datetime.now()
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
+        async with _transaction() as db:
             # Получаем активную сессию
             async with db.execute(
                 'SELECT * FROM sessions WHERE user_id = ? AND status = ?', 
@@ -199,85 +696,146 @@ class Database:
                 
                 session_dict = dict(active_session)
                 session_id = session_dict["id"]
-                start_time = datetime.datetime.fromisoformat(session_dict["start_time"])
+                start_time = session_dict["start_time"]
                 
                 # Вычисляем продолжительность в секундах
                 duration = int((now - start_time).total_seconds())
                 
-                # Обновляем сессию
-                await db.execute('''
+                # Обновляем сессию и сразу получаем обновленную строку
+                async with db.execute('''
                     UPDATE sessions 
                     SET end_time = ?, duration = ?, status = ? 
                     WHERE id = ?
-                ''', (now, duration, SESSION_STATUS["COMPLETED"], session_id))
-                
-                await db.commit()
-                
-                # Получаем обновленную информацию о сессии
-                async with db.execute('SELECT * FROM sessions WHERE id = ?', (session_id,)) as cursor:
+                    RETURNING *
+                ''', (now, duration, SESSION_STATUS["COMPLETED"], session_id)) as cursor:
                     updated_session = await cursor.fetchone()
                     return dict(updated_session) if updated_session else None
     
     @staticmethod
-    async def get_active_session(user_id: int) -> Optional[Dict[str, Any]]:
+    async def get_active_session(user_id: int) -> Optional[Session]:
         """Получение информации об активной сессии пользователя."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
+        async with _connect() as db:
             async with db.execute(
-                'SELECT * FROM sessions WHERE user_id = ? AND status IN (?, ?)', 
+                _SQL["get_open_session"],
                 (user_id, SESSION_STATUS["ACTIVE"], SESSION_STATUS["PAUSED"])
             ) as cursor:
                 session = await cursor.fetchone()
-                return dict(session) if session else None
+                return Session(**dict(session)) if session else None
     
     @staticmethod
     async def add_note(user_id: int, content: str, session_id: Optional[int] = None, category: str = "Общее") -> int:
         """Добавление заметки. Если session_id не указан, пытаемся найти активную сессию."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _transaction() as db:
             # Если ID сессии не указан, пробуем найти активную
             if session_id is None:
-                db.row_factory = aiosqlite.Row
                 async with db.execute(
-                    'SELECT id FROM sessions WHERE user_id = ? AND status = ?',
+                    _SQL["get_session_id_by_status"],
                     (user_id, SESSION_STATUS["ACTIVE"])
                 ) as cursor:
                     active_session = await cursor.fetchone()
                     session_id = active_session["id"] if active_session else None
 
             # Добавляем заметку
-            cursor = await db.execute('''
-                INSERT INTO notes (user_id, session_id, content, category)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, session_id, content, category))
+            cursor = await db.execute(
+                _SQL["insert_note"],
+                (user_id, session_id, content, category)
+            )
 
             note_id = cursor.lastrowid
-            await db.commit()
             return note_id
+
+    @staticmethod
+    async def add_note_batched(user_id: int, content: str, session_id: Optional[int], category: str = "Общее") -> None:
+        """Запись заметки в составе пачки: возвращается после фиксации транзакции."""
+        global _note_queue, _note_writer_task
+
+        if _note_queue is None:
+            _note_queue = asyncio.Queue()
+        if _note_writer_task is None or _note_writer_task.done():
+            _note_writer_task = asyncio.create_task(Database._note_writer())
+
+        # Время фиксируем при постановке в очередь, а не при записи
+        written = asyncio.get_running_loop().create_future()
+        await _note_queue.put(((user_id, session_id, content, category, datetime.datetime.now()), written))
+        # Ошибка записи пачки пробрасывается каждому, кто ждет свою заметку
+        await written
+
+    @staticmethod
+    async def close() -> None:
+        """Закрытие общих соединений с базой данных."""
+        global _db, _read_db
+        if _read_db is not None:
+            read_db, _read_db = _read_db, None
+            await read_db.close()
+        if _db is not None:
+            db, _db = _db, None
+            # Обновляем статистику планировщика запросов для новых индексов
+            await db.execute("PRAGMA optimize")
+            await db.close()
+
+    @staticmethod
+    async def flush_notes() -> None:
+        """Ожидание записи всех заметок из очереди."""
+        if _note_queue is not None and _note_writer_task is not None and not _note_writer_task.done():
+            await _note_queue.join()
+
+    @staticmethod
+    async def stop_note_writer() -> None:
+        """Запись оставшихся заметок и остановка фоновой задачи записи."""
+        global _note_writer_task
+        await Database.flush_notes()
+        if _note_writer_task is not None:
+            task, _note_writer_task = _note_writer_task, None
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+    @staticmethod
+    async def _note_writer() -> None:
+        """Фоновая запись заметок из очереди пачками."""
+        while True:
+            batch = [await _note_queue.get()]
+
+            try:
+                # Даем накопиться заметкам, пришедшим почти одновременно
+                await asyncio.sleep(NOTE_BATCH_DELAY)
+                while len(batch) < NOTE_BATCH_SIZE and not _note_queue.empty():
+                    batch.append(_note_queue.get_nowait())
+
+                await Database._insert_notes([row for row, _ in batch])
+            except Exception as e:
+                logger.exception("Ошибка при записи заметок")
+                for _, written in batch:
+                    if not written.done():
+                        written.set_exception(e)
+            else:
+                for _, written in batch:
+                    if not written.done():
+                        written.set_result(None)
+            finally:
+                # При остановке задачи ожидающие не должны зависнуть
+                for _, written in batch:
+                    written.cancel()
+                    _note_queue.task_done()
+
+    @staticmethod
+    async def _insert_notes(batch: List[Tuple[int, Optional[int], str, str, datetime.datetime]]) -> None:
+        """Запись пачки заметок одной транзакцией."""
+        async with _transaction() as db:
+            await db.executemany(_SQL["insert_note_with_time"], batch)
             
     @staticmethod
-    async def get_sessions_by_timeframe(user_id: int, start_date: datetime.datetime, end_date: datetime.datetime) -> List[Dict[str, Any]]:
-        """Получение списка сессий за указанный период времени."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            query = '''
-                SELECT * FROM sessions 
-                WHERE user_id = ? 
-                AND (
-                    (start_time BETWEEN ? AND ?) OR 
-                    (end_time BETWEEN ? AND ?) OR
-                    (start_time <= ? AND (end_time >= ? OR end_time IS NULL))
-                )
-                ORDER BY start_time ASC
-            '''
-            params = (
-                user_id, 
-                start_date, end_date, 
-                start_date, end_date,
-                start_date, end_date
-            )
+    async def get_sessions_by_timeframe(
+        user_id: int,
+        start_date: datetime.datetime,
+        end_date: datetime.datetime
+    ) -> List[Dict[str, Any]]:
+        """Получение списка завершенных сессий, начатых в указанный период."""
+        async with _connect() as db:
+            params = (user_id, SESSION_STATUS["COMPLETED"], start_date, end_date)
             
             sessions = []
-            async with db.execute(query, params) as cursor:
+            async with db.execute(_SQL["get_sessions_by_timeframe"], params) as cursor:
                 async for row in cursor:
                     sessions.append(dict(row))
             
@@ -288,121 +846,87 @@ class Database:
         """Поставить активную сессию на паузу."""
         now = datetime.datetime.now()
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # Проверяем существование таблицы breaks
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS breaks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id INTEGER,
-                    user_id INTEGER,
-                    start_time TIMESTAMP,
-                    end_time TIMESTAMP,
-                    duration INTEGER,
-                    reason TEXT,
-                    FOREIGN KEY (session_id) REFERENCES sessions (id),
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
-            
-            # Находим активную сессию
+        async with _transaction() as db:
+            # Ставим активную сессию на паузу одним запросом (проверка + обновление)
             async with db.execute(
-                'SELECT * FROM sessions WHERE user_id = ? AND status = ?', 
-                (user_id, SESSION_STATUS["ACTIVE"])
+                'UPDATE sessions SET status = ? WHERE user_id = ? AND status = ? RETURNING *',
+                (SESSION_STATUS["PAUSED"], user_id, SESSION_STATUS["ACTIVE"])
             ) as cursor:
                 session = await cursor.fetchone()
-                if not session:
-                    return None
-                    
-                session_dict = dict(session)
-                session_id = session_dict["id"]
-                
-                # Обновляем статус сессии
-                await db.execute(
-                    'UPDATE sessions SET status = ? WHERE id = ?', 
-                    (SESSION_STATUS["PAUSED"], session_id)
-                )
-                
-                # Добавляем запись о перерыве
-                await db.execute('''
-                    INSERT INTO breaks (session_id, user_id, start_time, reason) 
-                    VALUES (?, ?, ?, ?)
-                ''', (session_id, user_id, now, reason))
-                    
-                await db.commit()
-                return session_dict
+            if not session:
+                return None
+
+            session_dict = dict(session)
+            session_id = session_dict["id"]
+
+            # Добавляем запись о перерыве
+            await db.execute('''
+                INSERT INTO breaks (session_id, user_id, start_time, reason) 
+                VALUES (?, ?, ?, ?)
+            ''', (session_id, user_id, now, reason))
+
+            return session_dict
 
     @staticmethod
     async def resume_work_session(user_id: int) -> Optional[Dict[str, Any]]:
         """Возобновить работу после перерыва."""
         now = datetime.datetime.now()
         
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # Находим приостановленную сессию
+        async with _transaction() as db:
+            # Возобновляем приостановленную сессию одним запросом (проверка + обновление)
             async with db.execute(
-                'SELECT * FROM sessions WHERE user_id = ? AND status = ?', 
-                (user_id, SESSION_STATUS["PAUSED"])
+                'UPDATE sessions SET status = ? WHERE user_id = ? AND status = ? RETURNING *',
+                (SESSION_STATUS["ACTIVE"], user_id, SESSION_STATUS["PAUSED"])
             ) as cursor:
                 session = await cursor.fetchone()
-                if not session:
-                    return None
-                    
-                session_dict = dict(session)
-                session_id = session_dict["id"]
-                
-                # Обновляем статус сессии
-                await db.execute(
-                    'UPDATE sessions SET status = ? WHERE id = ?', 
-                    (SESSION_STATUS["ACTIVE"], session_id)
-                )
-                
-                # Завершаем последний перерыв
-                await db.execute('''
-                    UPDATE breaks 
-                    SET end_time = ?, duration = (strftime('%s', ?) - strftime('%s', start_time))
-                    WHERE session_id = ? AND end_time IS NULL
-                ''', (now, now, session_id))
-                    
-                await db.commit()
-                return session_dict
+            if not session:
+                return None
+
+            session_dict = dict(session)
+            session_id = session_dict["id"]
+
+            # Завершаем последний перерыв
+            await db.execute('''
+                UPDATE breaks 
+                SET end_time = ?, duration = (strftime('%s', ?) - strftime('%s', start_time))
+                WHERE session_id = ? AND end_time IS NULL
+            ''', (now, now, session_id))
+
+            return session_dict
                 
     @staticmethod
     async def get_session_breaks(session_id: int) -> List[Dict[str, Any]]:
         """Получение списка всех перерывов для указанной сессии."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
+        async with _connect() as db:
             breaks = []
-            async with db.execute(
-                'SELECT * FROM breaks WHERE session_id = ? ORDER BY start_time ASC', 
-                (session_id,)
-            ) as cursor:
+            async with db.execute(_SQL["get_session_breaks"], (session_id,)) as cursor:
                 async for row in cursor:
                     breaks.append(dict(row))
             
             return breaks
             
+    @staticmethod
+    async def has_any_sessions(user_id: int) -> bool:
+        """Проверка, есть ли у пользователя хотя бы одна сессия."""
+        async with _connect() as db:
+            async with db.execute(_SQL["has_any_sessions"], (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                return bool(row[0])
+
+    @staticmethod
+    async def get_total_duration(user_id: int, start_date: datetime.datetime, end_date: datetime.datetime) -> int:
+        """Суммарная продолжительность сессий пользователя за период (в секундах)."""
+        async with _connect() as db:
+            async with db.execute(_SQL["get_total_duration"], (user_id, start_date, end_date)) as cursor:
+                row = await cursor.fetchone()
+                return row[0]
+
     @staticmethod
     async def get_user_notes(user_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-        """Получение списка заметок пользователя."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
-            query = '''
-                SELECT n.id, n.content, n.timestamp, n.category,
-                       s.category as session_category, s.start_time, s.status
-                FROM notes n
-                JOIN sessions s ON n.session_id = s.id
-                WHERE n.user_id = ?
-                ORDER BY n.timestamp DESC
-                LIMIT ?
-            '''
-            
+        """Получение списка заметок пользователя (текст обрезается до 100 символов, полная длина в content_len)."""
+        async with _connect() as db:
             notes = []
-            async with db.execute(query, (user_id, limit)) as cursor:
+            async with db.execute(_SQL["get_user_notes"], (user_id, limit)) as cursor:
                 async for row in cursor:
                     notes.append(dict(row))
             
@@ -411,9 +935,7 @@ class Database:
     @staticmethod
     async def get_session_notes(session_id: int) -> List[Dict[str, Any]]:
         """Получение списка заметок для указанной сессии."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
+        async with _connect() as db:
             notes = []
             async with db.execute(
                 'SELECT * FROM notes WHERE session_id = ? ORDER BY timestamp ASC',
@@ -425,97 +947,105 @@ class Database:
             return notes
             
     @staticmethod
-    async def get_sessions_by_timeframe(user_id: int, start_date: datetime.datetime, end_date: datetime.datetime) -> List[Dict[str, Any]]:
-        """Получение списка сессий пользователя за указанный период."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            
-            query = '''
-                SELECT * FROM sessions 
-                WHERE user_id = ? 
-                AND start_time >= ? 
-                AND start_time <= ? 
-                ORDER BY start_time DESC
-            '''
-            
-            sessions = []
-            async with db.execute(query, (user_id, start_date, end_date)) as cursor:
-                async for row in cursor:
-                    sessions.append(dict(row))
-            
-            return sessions
-    
+    async def _get_period_totals(user_id: int, start_date: datetime.datetime, end_date: datetime.datetime) -> Dict[str, Any]:
+        """Итоги по сессиям и перерывам за период (сессии отбираются по времени начала)."""
+        period = (user_id, start_date, end_date)
+        async with _connect() as db:
+            async with db.execute(
+                _SQL["period_categories"], (user_id, SESSION_STATUS["COMPLETED"], start_date, end_date)
+            ) as cursor:
+                categories: Dict[str, CategoryStats] = {
+                    row["category"]: {"count": row["count"], "duration": row["duration"]}
+                    for row in await cursor.fetchall()
+                }
+
+            async with db.execute(
+                _SQL["period_session_counts"], (SESSION_STATUS["ACTIVE"], SESSION_STATUS["PAUSED"], *period)
+            ) as cursor:
+                counts = await cursor.fetchone()
+
+            async with db.execute(_SQL["period_breaks"], period) as cursor:
+                breaks = await cursor.fetchone()
+
+        return {
+            "total_sessions": counts["total_sessions"],
+            "active_sessions": counts["active_sessions"],
+            "completed_sessions": sum(data["count"] for data in categories.values()),
+            "total_duration": sum(data["duration"] for data in categories.values()),
+            "total_breaks": breaks["total_breaks"],
+            "break_duration": breaks["break_duration"],
+            "categories": categories
+        }
+
     @staticmethod
-    async def get_daily_stats(user_id: int, date: datetime.date) -> Dict[str, Any]:
-        """Получение статистики за день."""
-        # Начало и конец дня
-        start_date = datetime.datetime.combine(date, datetime.time.min)
-        end_date = datetime.datetime.combine(date, datetime.time.max)
-        
-        # Получаем все сессии за день
-        sessions = await Database.get_sessions_by_timeframe(user_id, start_date, end_date)
-        
-        # Инициализируем статистику
-        stats = {
+    async def _get_daily_totals(user_id: int, start_date: datetime.date, days: int) -> List[Dict[str, Any]]:
+        """Итоги _get_period_totals для каждого из дней подряд, начиная со start_date (три запроса на весь период)."""
+        dates = [start_date + datetime.timedelta(days=i) for i in range(days)]
+        totals = {
+            date: {
+                "total_sessions": 0,
+                "active_sessions": 0,
+                "completed_sessions": 0,
+                "total_duration": 0,
+                "total_breaks": 0,
+                "break_duration": 0,
+                "categories": {}
+            }
+            for date in dates
+        }
+        period = (
+            user_id,
+            datetime.datetime.combine(dates[0], datetime.time.min),
+            datetime.datetime.combine(dates[-1], datetime.time.max)
+        )
+
+        async with _connect() as db:
+            async with db.execute(
+                _SQL["daily_categories"], (user_id, SESSION_STATUS["COMPLETED"], *period[1:])
+            ) as cursor:
+                for row in await cursor.fetchall():
+                    day = totals[datetime.date.fromisoformat(row["day"])]
+                    day["categories"][row["category"]] = {"count": row["count"], "duration": row["duration"]}
+                    day["completed_sessions"] += row["count"]
+                    day["total_duration"] += row["duration"]
+
+            async with db.execute(
+                _SQL["daily_session_counts"], (SESSION_STATUS["ACTIVE"], SESSION_STATUS["PAUSED"], *period)
+            ) as cursor:
+                for row in await cursor.fetchall():
+                    day = totals[datetime.date.fromisoformat(row["day"])]
+                    day["total_sessions"] = row["total_sessions"]
+                    day["active_sessions"] = row["active_sessions"]
+
+            async with db.execute(_SQL["daily_breaks"], period) as cursor:
+                for row in await cursor.fetchall():
+                    day = totals[datetime.date.fromisoformat(row["day"])]
+                    day["total_breaks"] = row["total_breaks"]
+                    day["break_duration"] = row["break_duration"]
+
+        return [totals[date] for date in dates]
+
+    @staticmethod
+    def _build_daily_stats(date: datetime.date, totals: Dict[str, Any]) -> DailyStats:
+        """Статистика за день из итогов периода."""
+        return {
             "date": date.strftime("%d.%m.%Y"),
-            "total_sessions": len(sessions),
-            "total_duration": 0,
-            "total_breaks": 0,
-            "break_duration": 0,
-            "categories": {},
-            "completed_sessions": 0,
-            "active_sessions": 0
+            "total_sessions": totals["total_sessions"],
+            "total_duration": totals["total_duration"],
+            "total_breaks": totals["total_breaks"],
+            "break_duration": totals["break_duration"],
+            "categories": totals["categories"],
+            "completed_sessions": totals["completed_sessions"],
+            "active_sessions": totals["active_sessions"]
         }
-        
-        # Обрабатываем каждую сессию
-        for session in sessions:
-            # Считаем только завершенные сессии для подсчета времени
-            if session["status"] == SESSION_STATUS["COMPLETED"]:
-                stats["total_duration"] += session["duration"]
-                stats["completed_sessions"] += 1
-                
-                # Учитываем категории
-                category = session["category"]
-                if category not in stats["categories"]:
-                    stats["categories"][category] = {
-                        "count": 0,
-                        "duration": 0
-                    }
-                stats["categories"][category]["count"] += 1
-                stats["categories"][category]["duration"] += session["duration"]
-            elif session["status"] in [SESSION_STATUS["ACTIVE"], SESSION_STATUS["PAUSED"]]:
-                stats["active_sessions"] += 1
-            
-            # Получаем перерывы для сессии
-            breaks = await Database.get_session_breaks(session["id"])
-            stats["total_breaks"] += len(breaks)
-            
-            # Считаем продолжительность перерывов
-            for break_item in breaks:
-                if break_item["end_time"] and break_item["duration"]:
-                    stats["break_duration"] += break_item["duration"]
-        
-        return stats
-    
+
     @staticmethod
-    async def get_weekly_stats(user_id: int, date: datetime.date) -> Dict[str, Any]:
-        """Получение статистики за неделю."""
-        # Определяем начало и конец недели (понедельник-воскресенье)
-        weekday = date.weekday()
-        start_date = date - datetime.timedelta(days=weekday)
+    def _build_weekly_stats(start_date: datetime.date, daily_stats: List[DailyStats]) -> WeeklyStats:
+        """Статистика за неделю из статистики по ее дням."""
         end_date = start_date + datetime.timedelta(days=6)
         
-        # Статистика по дням недели
-        daily_stats = []
-        current_date = start_date
-        
-        while current_date <= end_date:
-            day_stats = await Database.get_daily_stats(user_id, current_date)
-            daily_stats.append(day_stats)
-            current_date += datetime.timedelta(days=1)
-        
         # Суммарная статистика за неделю
-        weekly_summary = {
+        weekly_summary: WeeklyStats = {
             "start_date": start_date.strftime("%d.%m.%Y"),
             "end_date": end_date.strftime("%d.%m.%Y"),
             "total_sessions": 0,
@@ -544,9 +1074,33 @@ class Database:
                 weekly_summary["categories"][category]["duration"] += data["duration"]
         
         return weekly_summary
+
+    @staticmethod
+    async def get_daily_stats(user_id: int, date: datetime.date) -> DailyStats:
+        """Получение статистики за день."""
+        # Начало и конец дня
+        start_date = datetime.datetime.combine(date, datetime.time.min)
+        end_date = datetime.datetime.combine(date, datetime.time.max)
+        
+        totals = await Database._get_period_totals(user_id, start_date, end_date)
+        return Database._build_daily_stats(date, totals)
+    
+    @staticmethod
+    async def get_weekly_stats(user_id: int, date: datetime.date) -> WeeklyStats:
+        """Получение статистики за неделю."""
+        # Определяем начало недели (понедельник)
+        start_date = date - datetime.timedelta(days=date.weekday())
+        
+        # Статистика по дням недели считается одним проходом по базе
+        daily_totals = await Database._get_daily_totals(user_id, start_date, 7)
+        daily_stats = [
+            Database._build_daily_stats(start_date + datetime.timedelta(days=i), totals)
+            for i, totals in enumerate(daily_totals)
+        ]
+        return Database._build_weekly_stats(start_date, daily_stats)
     
     @staticmethod
-    async def get_monthly_stats(user_id: int, year: int, month: int) -> Dict[str, Any]:
+    async def get_monthly_stats(user_id: int, year: int, month: int) -> MonthlyStats:
         """Получение статистики за месяц."""
         # Определяем начало и конец месяца
         start_date = datetime.date(year, month, 1)
@@ -558,203 +1112,101 @@ class Database:
             next_month = datetime.date(year, month + 1, 1)
         end_date = next_month - datetime.timedelta(days=1)
         
-        # Получаем все сессии за месяц
+        # Понедельники недель, пересекающихся с месяцем (крайние недели выходят за его границы)
+        first_monday = start_date - datetime.timedelta(days=start_date.weekday())
+        week_count = (end_date - first_monday).days // 7 + 1
+        
+        # Итоги за месяц и статистика по дням всех его недель запрашиваются одновременно
         start_datetime = datetime.datetime.combine(start_date, datetime.time.min)
         end_datetime = datetime.datetime.combine(end_date, datetime.time.max)
-        sessions = await Database.get_sessions_by_timeframe(user_id, start_datetime, end_datetime)
-        
-        # Статистика по неделям
-        weekly_stats = []
-        current_date = start_date
-        
-        # Получаем статистику для каждой недели месяца
-        while current_date <= end_date:
-            # Если это понедельник или первый день месяца, начинаем новую неделю
-            if current_date.weekday() == 0 or current_date.day == 1:
-                week_stats = await Database.get_weekly_stats(user_id, current_date)
-                weekly_stats.append(week_stats)
-                # Переходим к следующей неделе
-                current_date += datetime.timedelta(days=7)
-            else:
-                # Находим ближайший понедельник
-                days_to_monday = 7 - current_date.weekday()
-                current_date += datetime.timedelta(days=days_to_monday)
+        totals, daily_totals = await asyncio.gather(
+            Database._get_period_totals(user_id, start_datetime, end_datetime),
+            Database._get_daily_totals(user_id, first_monday, week_count * 7)
+        )
+        daily_stats = [
+            Database._build_daily_stats(first_monday + datetime.timedelta(days=i), day_totals)
+            for i, day_totals in enumerate(daily_totals)
+        ]
+        weekly_stats = [
+            Database._build_weekly_stats(first_monday + datetime.timedelta(weeks=week), daily_stats[week * 7:week * 7 + 7])
+            for week in range(week_count)
+        ]
         
         # Суммарная статистика за месяц
-        monthly_summary = {
+        monthly_summary: MonthlyStats = {
             "year": year,
             "month": month,
             "month_name": datetime.date(year, month, 1).strftime("%B"),
-            "total_sessions": len(sessions),
-            "total_duration": 0,
-            "total_breaks": 0,
-            "break_duration": 0,
-            "categories": {},
+            "total_sessions": totals["total_sessions"],
+            "total_duration": totals["total_duration"],
+            "total_breaks": totals["total_breaks"],
+            "break_duration": totals["break_duration"],
+            "categories": totals["categories"],
             "weekly_stats": weekly_stats
         }
         
-        # Обрабатываем каждую сессию
-        for session in sessions:
-            # Считаем только завершенные сессии для подсчета времени
-            if session["status"] == SESSION_STATUS["COMPLETED"]:
-                monthly_summary["total_duration"] += session["duration"]
-                
-                # Учитываем категории
-                category = session["category"]
-                if category not in monthly_summary["categories"]:
-                    monthly_summary["categories"][category] = {
-                        "count": 0,
-                        "duration": 0
-                    }
-                monthly_summary["categories"][category]["count"] += 1
-                monthly_summary["categories"][category]["duration"] += session["duration"]
-            
-            # Получаем перерывы для сессии
-            breaks = await Database.get_session_breaks(session["id"])
-            monthly_summary["total_breaks"] += len(breaks)
-            
-            # Считаем продолжительность перерывов
-            for break_item in breaks:
-                if break_item["end_time"] and break_item["duration"]:
-                    monthly_summary["break_duration"] += break_item["duration"]
-        
         return monthly_summary
 
     @staticmethod
-    async def export_user_data_to_csv(user_id: int, file_path: str) -> bool:
-        """Экспорт всех данных пользователя в CSV файл."""
-        import csv
+    async def get_daily_durations(user_id: int, year: int, month: int) -> Dict[int, int]:
+        """Время завершенных сессий по дням месяца (день -> секунды) одним запросом."""
+        start_date = datetime.datetime(year, month, 1)
+        if month == 12:
+            end_date = datetime.datetime(year + 1, 1, 1)
+        else:
+            end_date = datetime.datetime(year, month + 1, 1)
 
-        try:
-            async with aiosqlite.connect(DATABASE_PATH) as db:
-                db.row_factory = aiosqlite.Row
+        async with _connect() as db:
+            async with db.execute(
+                _SQL["get_daily_durations"],
+                (user_id, SESSION_STATUS["COMPLETED"], start_date, end_date)
+            ) as cursor:
+                return {day: total_duration or 0 for day, total_duration in await cursor.fetchall()}
 
+    @staticmethod
+    async def export_user_data_csv(user_id: int) -> Optional[bytes]:
+        """Экспорт всех данных пользователя в CSV (содержимое файла в UTF-8)."""
+        try:
+            async with _connect() as db:
                 # Получаем данные пользователя
-                async with db.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                async with db.execute(_SQL["export_user"], (user_id,)) as cursor:
                     user = await cursor.fetchone()
 
                 if not user:
-                    return False
-
-                user_dict = dict(user)
-
-                # Получаем все сессии пользователя
-                sessions_query = '''
-                    SELECT s.*, u.first_name, u.last_name
-                    FROM sessions s
-                    JOIN users u ON s.user_id = u.user_id
-                    WHERE s.user_id = ?
-                    ORDER BY s.start_time DESC
-                '''
-
-                async with db.execute(sessions_query, (user_id,)) as cursor:
-                    sessions = [dict(row) for row in await cursor.fetchall()]
+                    return None
 
-                # Получаем все заметки пользователя
-                notes_query = '''
-                    SELECT n.*, s.category as session_category
-                    FROM notes n
-                    JOIN sessions s ON n.session_id = s.id
-                    WHERE n.user_id = ?
-                    ORDER BY n.timestamp DESC
-                '''
+                # По одному запросу на каждый лист, строки передаются в CSV без копирования в dict
+                async with db.execute(_SQL["export_sessions"], (user_id,)) as cursor:
+                    sessions = await cursor.fetchall()
 
-                async with db.execute(notes_query, (user_id,)) as cursor:
-                    notes = [dict(row) for row in await cursor.fetchall()]
+                async with db.execute(_SQL["export_notes"], (user_id,)) as cursor:
+                    notes = await cursor.fetchall()
 
-                # Получаем все перерывы пользователя
-                breaks_query = '''
-                    SELECT b.*, s.category as session_category
-                    FROM breaks b
-                    JOIN sessions s ON b.session_id = s.id
-                    WHERE b.user_id = ?
-                    ORDER BY b.start_time DESC
-                '''
+                async with db.execute(_SQL["export_breaks"], (user_id,)) as cursor:
+                    breaks = await cursor.fetchall()
 
-                async with db.execute(breaks_query, (user_id,)) as cursor:
-                    breaks = [dict(row) for row in await cursor.fetchall()]
-
-            # Создаем CSV файл с тремя листами
-            with open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-
-                # Лист 1: Информация о пользователе
-                writer.writerow(['ЛИСТ 1: ИНФОРМАЦИЯ О ПОЛЬЗОВАТЕЛЕ'])
-                writer.writerow(['ID пользователя', 'Имя', 'Фамилия', 'Username'])
-                writer.writerow([
-                    user_dict['user_id'],
-                    user_dict['first_name'] or '',
-                    user_dict['last_name'] or '',
-                    user_dict['username'] or ''
-                ])
-                writer.writerow([])  # Пустая строка
-
-                # Лист 2: Рабочие сессии
-                writer.writerow(['ЛИСТ 2: РАБОЧИЕ СЕССИИ'])
-                writer.writerow([
-                    'ID сессии', 'Дата начала', 'Дата окончания',
-                    'Продолжительность (сек)', 'Категория', 'Статус'
-                ])
-
-                for session in sessions:
-                    writer.writerow([
-                        session['id'],
-                        session['start_time'],
-                        session['end_time'] or '',
-                        session['duration'] or 0,
-                        session['category'],
-                        session['status']
-                    ])
-                writer.writerow([])  # Пустая строка
-
-                # Лист 3: Заметки
-                writer.writerow(['ЛИСТ 3: ЗАМЕТКИ'])
-                writer.writerow([
-                    'ID заметки', 'Текст заметки', 'Дата создания',
-                    'Категория сессии'
-                ])
-
-                for note in notes:
-                    writer.writerow([
-                        note['id'],
-                        note['content'],
-                        note['timestamp'],
-                        note['session_category']
-                    ])
-                writer.writerow([])  # Пустая строка
-
-                # Лист 4: Перерывы
-                writer.writerow(['ЛИСТ 4: ПЕРЕРЫВЫ'])
-                writer.writerow([
-                    'ID перерыва', 'ID сессии', 'Дата начала', 'Дата окончания',
-                    'Продолжительность (сек)', 'Причина'
-                ])
-
-                for break_item in breaks:
-                    writer.writerow([
-                        break_item['id'],
-                        break_item['session_id'],
-                        break_item['start_time'],
-                        break_item['end_time'] or '',
-                        break_item['duration'] or 0,
-                        break_item['reason']
-                    ])
+            # Формирование CSV занимает процессор, выполняем его в отдельном потоке
+            return await asyncio.to_thread(_build_user_data_csv, user, sessions, notes, breaks)
 
-            return True
+        except Exception:
+            logger.exception("Ошибка при экспорте данных пользователя %s", user_id)
+            return None
 
-        except Exception as e:
-            print(f"Ошибка при экспорте данных: {e}")
+    @staticmethod
+    async def export_user_data_to_csv(user_id: int, file_path: str) -> bool:
+        """Экспорт всех данных пользователя в CSV файл."""
+        data = await Database.export_user_data_csv(user_id)
+        if data is None:
             return False
 
+        await asyncio.to_thread(_write_bytes, file_path, data)
+        return True
+
     @staticmethod
     async def export_sessions_to_csv(user_id: int, start_date: str = None, end_date: str = None, file_path: str = None) -> bool:
         """Экспорт сессий пользователя в CSV за указанный период."""
-        import csv
-
         try:
-            async with aiosqlite.connect(DATABASE_PATH) as db:
-                db.row_factory = aiosqlite.Row
-
+            async with _connect() as db:
                 # Базовый запрос
                 query = '''
                     SELECT s.*, u.first_name, u.last_name
@@ -786,66 +1238,20 @@ class Database:
                 temp_dir = tempfile.gettempdir()
                 file_path = os.path.join(temp_dir, f'sessions_{user_id}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
 
-            with open(file_path, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-
-                # Заголовок
-                writer.writerow(['ОТЧЕТ ПО РАБОЧИМ СЕССИЯМ'])
-                writer.writerow([f'Пользователь ID: {user_id}'])
-                if start_date and end_date:
-                    writer.writerow([f'Период: с {start_date} по {end_date}'])
-                writer.writerow([])  # Пустая строка
-
-                # Заголовки колонок
-                writer.writerow([
-                    'Дата', 'Время начала', 'Время окончания',
-                    'Продолжительность', 'Категория', 'Статус'
-                ])
-
-                # Данные сессий
-                total_duration = 0
-                for session in sessions:
-                    start_time = datetime.datetime.fromisoformat(session['start_time'])
-                    end_time_str = session['end_time'] if session['end_time'] else 'Не завершена'
-
-                    if session['end_time']:
-                        end_time = datetime.datetime.fromisoformat(session['end_time'])
-                        duration = session['duration']
-                        total_duration += duration
-                    else:
-                        duration = 'Не завершена'
-
-                    writer.writerow([
-                        start_time.strftime('%Y-%m-%d'),
-                        start_time.strftime('%H:%M:%S'),
-                        end_time_str,
-                        duration,
-                        session['category'],
-                        session['status']
-                    ])
-
-                writer.writerow([])  # Пустая строка
-
-                # Итоговая статистика
-                writer.writerow(['ИТОГО:'])
-                if sessions:
-                    hours, remainder = divmod(total_duration, 3600)
-                    minutes, seconds = divmod(remainder, 60)
-                    writer.writerow([f'Общее время работы: {hours}ч {minutes}м {seconds}с'])
-                    writer.writerow([f'Количество сессий: {len(sessions)}'])
+            # Формирование и запись CSV выполняются в отдельном потоке
+            data = await asyncio.to_thread(_build_sessions_csv, user_id, sessions, start_date, end_date)
+            await asyncio.to_thread(_write_bytes, file_path, data)
 
             return True
 
-        except Exception as e:
-            print(f"Ошибка при экспорте сессий: {e}")
+        except Exception:
+            logger.exception("Ошибка при экспорте сессий пользователя %s", user_id)
             return False
 
     @staticmethod
     async def get_reminder_settings(user_id: int) -> Dict[str, Any]:
         """Получение настроек напоминаний пользователя."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-
+        async with _connect() as db:
             async with db.execute(
                 'SELECT * FROM reminder_settings WHERE user_id = ?',
                 (user_id,)
@@ -856,22 +1262,32 @@ class Database:
                 return dict(settings)
             else:
                 # Возвращаем настройки по умолчанию
-                return {
-                    'user_id': user_id,
-                    'work_reminder_enabled': 1,
-                    'work_reminder_minutes': 60,
-                    'break_reminder_enabled': 1,
-                    'break_reminder_minutes': 15,
-                    'long_break_reminder_enabled': 1,
-                    'long_break_reminder_minutes': 120,
-                    'daily_goal_enabled': 0,
-                    'daily_goal_minutes': 480
-                }
+                return {'user_id': user_id, **DEFAULT_REMINDER_SETTINGS}
+
+    @staticmethod
+    async def toggle_reminder_flag(user_id: int, column: str) -> Dict[str, Any]:
+        """Переключение флага напоминания. Возвращает обновленные настройки."""
+        if column not in REMINDER_FLAG_COLUMNS:
+            raise ValueError(f"Неизвестный флаг напоминания: {column}")
+
+        async with _transaction() as db:
+            # Строка с настройками по умолчанию, если пользователь их еще не менял
+            await db.execute(
+                'INSERT OR IGNORE INTO reminder_settings (user_id) VALUES (?)',
+                (user_id,)
+            )
+            async with db.execute(
+                f'UPDATE reminder_settings SET {column} = 1 - {column}, updated_at = CURRENT_TIMESTAMP '
+                'WHERE user_id = ? RETURNING *',
+                (user_id,)
+            ) as cursor:
+                settings = dict(await cursor.fetchone())
+            return settings
 
     @staticmethod
     async def update_reminder_settings(user_id: int, **settings) -> None:
         """Обновление настроек напоминаний пользователя."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
+        async with _transaction() as db:
             # Проверяем, существуют ли настройки пользователя
             async with db.execute(
                 'SELECT id FROM reminder_settings WHERE user_id = ?',
@@ -900,24 +1316,66 @@ class Database:
                 query = f'INSERT INTO reminder_settings ({", ".join(columns)}) VALUES ({", ".join(placeholders)})'
                 await db.execute(query, values)
 
-            await db.commit()
+    @staticmethod
+    async def log_sent_reminders(reminders: List[Tuple[int, str, Optional[int]]]) -> None:
+        """Запись отправленных напоминаний (user_id, тип, session_id) одной транзакцией."""
+        if not reminders:
+            return
+        async with _transaction() as db:
+            await db.executemany(_SQL["insert_sent_reminder"], reminders)
 
     @staticmethod
-    async def log_sent_reminder(user_id: int, reminder_type: str, session_id: int = None, message_id: int = None) -> None:
-        """Запись отправленного напоминания."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute(
-                'INSERT INTO sent_reminders (user_id, reminder_type, session_id, message_id) VALUES (?, ?, ?, ?)',
-                (user_id, reminder_type, session_id, message_id)
-            )
-            await db.commit()
+    async def get_reminder_candidates(day_start: datetime.datetime, day_end: datetime.datetime) -> List[ReminderCandidate]:
+        """Данные для проверки напоминаний по всем пользователям (постоянное число запросов)."""
+        open_statuses = (SESSION_STATUS["ACTIVE"], SESSION_STATUS["PAUSED"])
+        async with _connect() as db:
+            async with db.execute(_SQL["reminder_users"], open_statuses) as cursor:
+                users = await cursor.fetchall()
+            async with db.execute(_SQL["reminder_daily_durations"], (day_start, day_end)) as cursor:
+                durations = {row['user_id']: row['duration'] for row in await cursor.fetchall()}
+            async with db.execute(_SQL["reminder_last_sent"]) as cursor:
+                last_sent = await cursor.fetchall()
+            async with db.execute(_SQL["reminder_last_breaks"], open_statuses) as cursor:
+                last_breaks = {row['session_id']: row['start_time'] for row in await cursor.fetchall()}
+
+        last_reminders: Dict[int, Dict[str, datetime.datetime]] = {}
+        for row in last_sent:
+            last_reminders.setdefault(row['user_id'], {})[row['reminder_type']] = row['sent_at']
+
+        candidates = []
+        for row in users:
+            user_id = row['user_id']
+            if row['has_settings']:
+                settings = {key: row[key] for key in DEFAULT_REMINDER_SETTINGS}
+            else:
+                settings = dict(DEFAULT_REMINDER_SETTINGS)
+
+            session = None
+            if row['session_id'] is not None:
+                session = Session(
+                    id=row['session_id'],
+                    user_id=user_id,
+                    start_time=row['start_time'],
+                    end_time=row['end_time'],
+                    duration=row['duration'],
+                    status=row['status'],
+                    category=row['category']
+                )
+
+            candidates.append(ReminderCandidate(
+                user_id=user_id,
+                settings=settings,
+                session=session,
+                last_break=last_breaks.get(row['session_id']),
+                daily_duration=durations.get(user_id, 0),
+                last_reminders=last_reminders.get(user_id, {})
+            ))
+        return candidates
 
     @staticmethod
     async def get_last_reminder_time(user_id: int, reminder_type: str) -> datetime.datetime:
         """Получение времени последнего отправленного напоминания указанного типа."""
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            db.row_factory = aiosqlite.Row
-
+        async with _connect() as db:
             async with db.execute(
                 'SELECT sent_at FROM sent_reminders WHERE user_id = ? AND reminder_type = ? ORDER BY sent_at DESC LIMIT 1',
                 (user_id, reminder_type)
@@ -925,7 +1383,7 @@ class Database:
                 reminder = await cursor.fetchone()
 
             if reminder:
-                return datetime.datetime.fromisoformat(reminder['sent_at'])
+                return reminder['sent_at']
             else:
                 # Если напоминаний не было, возвращаем время далеко в прошлом
                 return datetime.datetime.min
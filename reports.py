@@ -18,7 +18,7 @@ async def get_daily_stats(user_id: int, date: Optional[datetime.date] = None) ->
     start_date = datetime.datetime.combine(date, datetime.time.min)
     end_date = datetime.datetime.combine(date, datetime.time.max)
     
-    # Получаем все сессии за указанный день
+    # Получаем завершенные сессии, начатые в указанный день
     sessions = await Database.get_sessions_by_timeframe(
         user_id, start_date, end_date
     )